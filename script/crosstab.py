@@ -7,6 +7,14 @@ Usage:
 Options:
     -l --layer=<layer>          Layer in shapefile (index or name) [default: 0]
     -a --attribute=<attribute>  Attribute to compare with map [default: truth]
+    -p --points                 Read map only at reference feature centroids
+    -s --stats=<stats_csv>      Write accuracy and area estimates to CSV file
+    -b --bootstrap=<n>          Add bootstrap intervals from <n> replicates to
+                                accuracy and area estimates
+    --processes=<n>             Number of processes for bootstrap [default: 1]
+    --seed=<seed>               Bootstrap RNG seed value
+    -j --threads=<threads>      Number of threads used to crosstabulate tiles
+                                (default: number of CPUs)
     -v --verbose                Show verbose debugging messages
     -h --help                   Show help
 
@@ -17,6 +25,11 @@ Example:
 
     > crosstab.py -v -a Ref_label CA_val_period.tif sample.shp crosstab.txt
 
+    Crosstabulate the same reference data, reading only the map pixels at
+        the centroid of each sample polygon:
+
+    > crosstab.py -v -p -a Ref_label CA_val_period.tif sample.shp crosstab.txt
+
     Outputs:
         ,Map-Class_1,Map-Class_2,Map-Class_3,Map-Class_255
         Ref-Class_1,12,4,1,5
@@ -29,17 +42,32 @@ Example:
 from __future__ import print_function
 
 import logging
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import os
 import sys
+import threading
 
 from docopt import docopt
 import numpy as np
 try:
     from osgeo import gdal
+    from osgeo import gdal_array
     from osgeo import ogr
+    from osgeo import osr
 except:
     import gdal
+    import gdal_array
     import ogr
+    import osr
+
+# Shared modules are kept with the plugin source
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src'))
+from accuracy import (accuracy_stats, bootstrap_intervals, class_weights,
+                      confidence_interval, error_matrix)
+from histogram import block_windows, class_histogram, raster_histogram
+from rawraster import mapped_band
 
 __version__ = '0.1.0'
 
@@ -56,25 +84,19 @@ logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s',
                     datefmt='%H:%M:%S')
 logger = logging.getLogger(__name__)
 
+# Size of tiles rasterized and crosstabulated at once
+TILE_SIZE = 1024
 
-def rasterize_map(raster_file, vector_file, attribute, layer=1):
-    """ Rasterizes vector file to extent/size of raster """
-    # Open raster file
-    try:
-        raster_ds = gdal.Open(raster_file, gdal.GA_ReadOnly)
-    except:
-        logger.error('Cannot open input raster')
-        sys.exit(1)
-    raster = raster_ds.GetRasterBand(1).ReadAsArray()
-    logger.debug('Read in raster file')
+# Raster and vector datasets opened by each worker thread
+_thread_local = threading.local()
 
-    # Get raster NoDataValue
-    ndv = raster_ds.GetRasterBand(1).GetNoDataValue()
-    if not ndv:
-        logger.warning('Could not find NoDataValue for raster')
-        logger.warning('Setting NoDataValue to 0')
-        ndv = 0
 
+def open_reference(vector_file, attribute, layer=0):
+    """ Open layer of reference vector file and check it has `attribute`
+
+    Returns the vector dataset with the layer, since the layer is only valid
+    while its dataset is open.
+    """
     # Open vector file
     try:
         vector = ogr.Open(vector_file)
@@ -84,6 +106,7 @@ def rasterize_map(raster_file, vector_file, attribute, layer=1):
     logger.debug('Opened vector file')
 
     # Try getting layer - try by index if layer is int, or string if not
+    name = layer
     try:
         layer = int(layer)
     except:
@@ -95,7 +118,7 @@ def rasterize_map(raster_file, vector_file, attribute, layer=1):
         layer = vector.GetLayerByIndex(layer)
         if layer is None:
             logger.debug('Could not open layer by index... trying by name')
-            layer = str(layer)
+            layer = str(name)
         else:
             logger.debug('Opened layer by index')
 
@@ -124,63 +147,166 @@ def rasterize_map(raster_file, vector_file, attribute, layer=1):
         sys.exit(1)
     logger.debug('Found attribute {a} in vector file'.format(a=attribute))
 
-    # If we've passed checks so far, setup memory raster
-    logger.debug('Setting up memory raster for rasterization')
-    mem_driver = gdal.GetDriverByName('MEM')
+    return (vector, layer)
 
-    mem_ds = mem_driver.Create('',
-                               raster_ds.RasterXSize,
-                               raster_ds.RasterYSize,
-                               1,
-                               raster_ds.GetRasterBand(1).DataType)
-    mem_ds.SetProjection(raster_ds.GetProjection())
-    mem_ds.SetGeoTransform(raster_ds.GetGeoTransform())
-    logger.debug('Set up memory dataset for rasterization')
 
-    # Fill with NDV
-    mem_ds.GetRasterBand(1).Fill(ndv)
-
-    # Rasterize
-    status = gdal.RasterizeLayer(mem_ds,
-                                 [1],
-                                 layer,
-                                 None, None,
-                                 burn_values=[ndv],
-                                 options=['ALL_TOUCHED=FALSE',
-                                          'ATTRIBUTE={a}'.format(a=attribute)]
-                                 )
-
-    if status != 0:
-        logger.error('Could not rasterize vector')
+def open_raster(raster_file):
+    """ Open raster file and return dataset and its NoDataValue """
+    try:
+        raster_ds = gdal.Open(raster_file, gdal.GA_ReadOnly)
+    except:
+        logger.error('Cannot open input raster')
         sys.exit(1)
-    else:
-        logger.debug('Rasterized vector file')
 
-    # Get raster from dataset and return
-    print(np.unique(mem_ds.GetRasterBand(1).ReadAsArray()))
-    return (mem_ds.GetRasterBand(1).ReadAsArray(), raster, ndv)
+    # Get raster NoDataValue
+    ndv = raster_ds.GetRasterBand(1).GetNoDataValue()
+    if not ndv:
+        logger.warning('Could not find NoDataValue for raster')
+        logger.warning('Setting NoDataValue to 0')
+        ndv = 0
+
+    return (raster_ds, ndv)
 
 
-def crosstabulate(rasterized, raster, ndv=0):
-    """ Crosstabulate raster against rasterized vector file """
-    # Find all values in either dataset
-    uniqs = np.unique(np.concatenate([
-        np.unique(rasterized[rasterized != ndv]),
-        np.unique(raster[raster != ndv])]))
+def _raster_srs(raster_ds):
+    """ Return spatial reference of raster dataset, or None if unknown """
+    wkt = raster_ds.GetProjection()
+    if not wkt:
+        return None
+    srs = osr.SpatialReference()
+    srs.ImportFromWkt(wkt)
 
-    # Crosstabulate
-    tab = np.zeros((uniqs.size, uniqs.size))
+    return srs
 
-    for i, uv_row in enumerate(uniqs):
-        for j, uv_col in enumerate(uniqs):
-            tab[i, j] = (raster[rasterized == uv_row] == uv_col).sum()
-    logger.debug('Crosstabulated map with reference data')
 
+def _srs_transform(source, target):
+    """ Return transformation between spatial references
+
+    Returns None if either spatial reference is unknown or both are the same,
+    in which case coordinates need no transformation.
+    """
+    if source is None or target is None or source.IsSame(target):
+        return None
+
+    # Keep x/y as easting/northing (or longitude/latitude) in GDAL >= 3
+    if hasattr(osr, 'OAMS_TRADITIONAL_GIS_ORDER'):
+        source, target = source.Clone(), target.Clone()
+        source.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        target.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+
+    return osr.CoordinateTransformation(source, target)
+
+
+def _pixel_location(gt, x, y):
+    """ Return row and column of pixels containing map coordinates """
+    inv_gt = gdal.InvGeoTransform(gt)
+    # GDAL < 2.0 also returns success flag
+    if len(inv_gt) == 2:
+        inv_gt = inv_gt[1]
+
+    col = np.floor(inv_gt[0] + x * inv_gt[1] + y * inv_gt[2])
+    row = np.floor(inv_gt[3] + x * inv_gt[4] + y * inv_gt[5])
+
+    return (row.astype(np.int64), col.astype(np.int64))
+
+
+def read_pixels(band, rows, cols):
+    """ Read values of a raster band at pixel locations
+
+    Pixel locations are grouped by the block of the band containing them,
+    and each block group is read with one window spanning its pixels.
+
+    Args:
+      band (gdal.Band): raster band
+      rows (np.ndarray): pixel row numbers
+      cols (np.ndarray): pixel column numbers
+
+    Returns:
+      np.ndarray: value of each pixel
+
+    """
+    values = np.zeros(rows.size,
+                      dtype=gdal_array.GDALTypeCodeToNumericTypeCode(
+                          band.DataType))
+
+    block_xsize, block_ysize = band.GetBlockSize()
+    n_xblocks = -(-band.XSize // block_xsize)
+    blocks = (rows // block_ysize) * n_xblocks + cols // block_xsize
+
+    order = np.argsort(blocks, kind='mergesort')
+    blocks, split = np.unique(blocks[order], return_index=True)
+
+    for idx in np.split(order, split[1:]) if rows.size else []:
+        yoff, xoff = rows[idx].min(), cols[idx].min()
+        ysize = rows[idx].max() - yoff + 1
+        xsize = cols[idx].max() - xoff + 1
+
+        window = band.ReadAsArray(int(xoff), int(yoff),
+                                  int(xsize), int(ysize))
+        values[idx] = window[rows[idx] - yoff, cols[idx] - xoff]
+
+    return values
+
+
+def read_reference_pixels(raster_file, vector_file, attribute, layer=1):
+    """ Reads map values at the centroid of each reference feature
+
+    Only the map pixels containing reference features are read, so memory
+    use and reading time depend on the number of features and not the size
+    of the map.
+
+    Returns:
+      tuple: reference labels, map values, and map NoDataValue
+
+    """
+    # Open raster file
+    raster_ds, ndv = open_raster(raster_file)
+    band = mapped_band(raster_ds.GetRasterBand(1))
+
+    # Open vector file
+    vector, layer = open_reference(vector_file, attribute, layer=layer)
+
+    # Locate centroid of each feature in map coordinates
+    transform = _srs_transform(layer.GetSpatialRef(), _raster_srs(raster_ds))
+    reference, x, y = [], [], []
+    for feature in layer:
+        geom = feature.GetGeometryRef()
+        if geom is None:
+            continue
+        centroid = geom.Centroid()
+        if transform is not None:
+            centroid.Transform(transform)
+        reference.append(feature.GetField(attribute))
+        x.append(centroid.GetX())
+        y.append(centroid.GetY())
+    logger.debug('Found {n} reference features'.format(n=len(reference)))
+
+    reference = np.array(reference)
+    rows, cols = _pixel_location(raster_ds.GetGeoTransform(),
+                                 np.array(x, dtype=np.float64),
+                                 np.array(y, dtype=np.float64))
+
+    # Exclude features outside of map
+    inside = ((rows >= 0) & (rows < band.YSize) &
+              (cols >= 0) & (cols < band.XSize))
+    if not inside.all():
+        logger.warning('Excluding {n} reference features outside of the '
+                       'map'.format(n=(~inside).sum()))
+    reference, rows, cols = reference[inside], rows[inside], cols[inside]
+
+    predicted = read_pixels(band, rows, cols)
+    logger.debug('Read map values of reference features')
+
+    return (reference, predicted, ndv)
+
+
+def format_crosstab(tab, classes):
+    """ Return error matrix as a table of strings with class headers """
     # Setup array headers
     rownames = np.array(['Ref-Class_' + str(u)
-                        for u in uniqs])[:, np.newaxis]
+                        for u in classes])[:, np.newaxis]
     colnames = ['']
-    colnames.extend(['Map-Class_' + str(u) for u in uniqs])
+    colnames.extend(['Map-Class_' + str(u) for u in classes])
 
     pretty_tab = np.hstack((rownames, np.char.mod('%i', tab)))
     pretty_tab = np.vstack((colnames, pretty_tab))
@@ -188,6 +314,266 @@ def crosstabulate(rasterized, raster, ndv=0):
     return pretty_tab
 
 
+def crosstabulate_points(reference, predicted, ndv=0):
+    """ Crosstabulate map values against reference labels of samples
+
+    Returns:
+      tuple: sorted classes and error matrix with reference classes as rows
+        and map classes as columns
+
+    """
+    valid = predicted != ndv
+    reference, predicted = reference[valid], predicted[valid]
+
+    uniqs = np.union1d(reference, predicted)
+
+    # Crosstabulate
+    tab = error_matrix(reference, predicted, uniqs)
+    logger.debug('Crosstabulated map with reference samples')
+
+    return (uniqs, tab)
+
+
+def merge_error_matrices(a, b):
+    """ Add together error matrices with possibly different classes
+
+    Args:
+      a (tuple): sorted classes and error matrix
+      b (tuple): sorted classes and error matrix
+
+    Returns:
+      tuple: sorted classes of both error matrices and their sum
+
+    """
+    classes = np.union1d(a[0], b[0])
+    tab = np.zeros((classes.size, classes.size), dtype=np.int64)
+    for _classes, _tab in (a, b):
+        idx = np.searchsorted(classes, _classes)
+        tab[np.ix_(idx, idx)] += _tab
+
+    return (classes, tab)
+
+
+def _thread_datasets(raster_file, vector_file, attribute, layer):
+    """ Return map dataset, map band, reference layer and transformation
+    from map to reference coordinates, if needed, opened by and for use only
+    in the current thread
+    """
+    datasets = getattr(_thread_local, 'datasets', None)
+    if datasets is None:
+        datasets = _thread_local.datasets = {}
+
+    key = (raster_file, vector_file, attribute, layer)
+    if key not in datasets:
+        raster_ds, _ = open_raster(raster_file)
+        vector, vector_layer = open_reference(vector_file, attribute,
+                                              layer=layer)
+        band = mapped_band(raster_ds.GetRasterBand(1))
+        # Transformations are not thread safe, so each thread has its own
+        transform = _srs_transform(_raster_srs(raster_ds),
+                                   vector_layer.GetSpatialRef())
+        datasets[key] = (raster_ds, band, vector, vector_layer, transform)
+
+    raster_ds, band, _, vector_layer, transform = datasets[key]
+    return (raster_ds, band, vector_layer, transform)
+
+
+def _crosstab_tile(job):
+    """ Rasterize reference layer within a tile of the map and crosstabulate
+
+    Returns None if no reference features are rasterized within the tile.
+    """
+    raster_file, vector_file, attribute, layer, ndv, window = job
+    xoff, yoff, xsize, ysize = window
+
+    raster_ds, band, vector_layer, transform = _thread_datasets(
+        raster_file, vector_file, attribute, layer)
+    gt = raster_ds.GetGeoTransform()
+    tile_gt = (gt[0] + xoff * gt[1] + yoff * gt[2], gt[1], gt[2],
+               gt[3] + xoff * gt[4] + yoff * gt[5], gt[4], gt[5])
+
+    # Only consider reference features within the tile, bounded in reference
+    #   coordinates by points along the tile edges since edges may curve
+    edge = np.linspace(0, 1, 11)
+    cols = np.concatenate((edge * xsize, edge * xsize,
+                           np.zeros_like(edge), np.full_like(edge, xsize)))
+    rows = np.concatenate((np.zeros_like(edge), np.full_like(edge, ysize),
+                           edge * ysize, edge * ysize))
+    x = tile_gt[0] + cols * gt[1] + rows * gt[2]
+    y = tile_gt[3] + cols * gt[4] + rows * gt[5]
+    if transform is not None:
+        x, y = zip(*[transform.TransformPoint(float(_x), float(_y))[:2]
+                     for _x, _y in zip(x, y)])
+    vector_layer.SetSpatialFilterRect(min(x), min(y), max(x), max(y))
+
+    mem_ds = gdal.GetDriverByName('MEM').Create(
+        '', xsize, ysize, 1, raster_ds.GetRasterBand(1).DataType)
+    mem_ds.SetProjection(raster_ds.GetProjection())
+    mem_ds.SetGeoTransform(tile_gt)
+    mem_ds.GetRasterBand(1).Fill(ndv)
+
+    # Features are reprojected into map coordinates by GDAL when rasterized
+    gdal.RasterizeLayer(mem_ds,
+                        [1],
+                        vector_layer,
+                        None, None,
+                        burn_values=[ndv],
+                        options=['ALL_TOUCHED=FALSE',
+                                 'ATTRIBUTE={a}'.format(a=attribute)]
+                        )
+    rasterized = mem_ds.GetRasterBand(1).ReadAsArray()
+    mem_ds = None
+
+    touched = rasterized != ndv
+    if not touched.any():
+        return None
+
+    raster = band.ReadAsArray(xoff, yoff, xsize, ysize)
+    reference = rasterized[touched]
+    predicted = raster[touched]
+
+    valid = predicted != ndv
+    reference, predicted = reference[valid], predicted[valid]
+
+    classes = np.union1d(class_histogram(reference)[0],
+                         class_histogram(predicted)[0])
+
+    return (classes, error_matrix(reference, predicted, classes))
+
+
+def crosstabulate_tiles(raster_file, vector_file, attribute, layer=0,
+                        n_threads=None):
+    """ Crosstabulate raster against vector file one tile at a time
+
+    The reference layer is rasterized within each tile of the map, using a
+    spatial filter to find the features within the tile, and the matching
+    window of the map is read and added to a running error matrix. Tiles are
+    divided among a pool of threads.
+
+    Args:
+      raster_file (str): map filename
+      vector_file (str): reference vector filename
+      attribute (str): reference layer attribute containing labels
+      layer (int or str, optional): reference layer index or name
+      n_threads (int, optional): number of threads (default: number of CPUs)
+
+    Returns:
+      tuple: sorted classes and error matrix with reference classes as rows
+        and map classes as columns
+
+    """
+    if n_threads is None:
+        n_threads = multiprocessing.cpu_count()
+
+    # Check inputs before dividing work
+    raster_ds, ndv = open_raster(raster_file)
+    open_reference(vector_file, attribute, layer=layer)
+    band = raster_ds.GetRasterBand(1)
+
+    # Include every map class in table
+    map_classes = raster_histogram(mapped_band(band))[0]
+    map_classes = map_classes[map_classes != ndv]
+    tab = (map_classes,
+           np.zeros((map_classes.size, map_classes.size), dtype=np.int64))
+
+    jobs = ((raster_file, vector_file, attribute, layer, ndv, window)
+            for window in block_windows(band, tile_size=TILE_SIZE))
+
+    logger.debug('Crosstabulating tiles using {n} threads'.format(
+        n=n_threads))
+    pool = ThreadPool(max(n_threads, 1))
+    try:
+        for tile_tab in pool.imap_unordered(_crosstab_tile, jobs):
+            if tile_tab is not None:
+                tab = merge_error_matrices(tab, tile_tab)
+    finally:
+        pool.close()
+        pool.join()
+    logger.debug('Crosstabulated map with reference data')
+
+    return tab
+
+
+def estimate_accuracy(classes, tab, raster_ds, ndv=0,
+                      bootstrap=None, n_processes=1, seed=None):
+    """ Estimate accuracy and area of each class from an error matrix
+
+    Map classes are used as the sampling strata, weighted by their proportion
+    of the map (excluding `ndv`) from the same histogram used to design the
+    sample.
+
+    Args:
+      classes (np.ndarray): sorted classes of error matrix
+      tab (np.ndarray): error matrix with reference classes as rows and map
+        classes as columns
+      raster_ds (gdal.Dataset): map dataset
+      ndv (int, optional): map NoDataValue
+      bootstrap (int, optional): number of replicates for bootstrap 95%
+        percentile intervals of accuracy and area, if any
+      n_processes (int, optional): number of processes for bootstrap
+      seed (int, optional): bootstrap RNG seed
+
+    Returns:
+      np.ndarray: table of estimates, standard errors and 95% confidence
+        intervals of area with a row for each class and a row for overall
+        accuracy
+
+    """
+    band = mapped_band(raster_ds.GetRasterBand(1))
+    hist = raster_histogram(band)
+    weights = class_weights(classes, hist, nodata=[ndv])
+
+    # Area of map in map units
+    gt = raster_ds.GetGeoTransform()
+    pixel_area = abs(gt[1] * gt[5] - gt[2] * gt[4])
+    map_area = hist[1][hist[0] != ndv].sum() * pixel_area
+
+    stats = accuracy_stats(tab, weights)
+    area = stats['area'] * map_area
+    area_lower, area_upper = confidence_interval(area,
+                                                 stats['area_se'] * map_area)
+
+    header = ['Class', 'Map-Weight', 'Samples',
+              'Users', 'Users-SE', 'Producers', 'Producers-SE',
+              'Area-Proportion', 'Area-Proportion-SE',
+              'Area', 'Area-CI95-Lower', 'Area-CI95-Upper']
+
+    columns = np.column_stack((weights, tab.sum(axis=0),
+                               stats['users'], stats['users_se'],
+                               stats['producers'], stats['producers_se'],
+                               stats['area'], stats['area_se'],
+                               area, area_lower, area_upper))
+    # Overall accuracy summarizes both user's and producer's accuracy
+    overall = [1, tab.sum(),
+               stats['overall'], stats['overall_se'],
+               stats['overall'], stats['overall_se'],
+               1, 0, map_area, map_area, map_area]
+
+    if bootstrap:
+        intervals = bootstrap_intervals(tab, weights, n_replicates=bootstrap,
+                                        n_processes=n_processes, seed=seed)
+        header.extend(['Users-Boot95-Lower', 'Users-Boot95-Upper',
+                       'Producers-Boot95-Lower', 'Producers-Boot95-Upper',
+                       'Area-Boot95-Lower', 'Area-Boot95-Upper'])
+        columns = np.column_stack((columns,
+                                   intervals['users'][0],
+                                   intervals['users'][1],
+                                   intervals['producers'][0],
+                                   intervals['producers'][1],
+                                   intervals['area'][0] * map_area,
+                                   intervals['area'][1] * map_area))
+        overall.extend([intervals['overall'][0], intervals['overall'][1],
+                        intervals['overall'][0], intervals['overall'][1],
+                        map_area, map_area])
+
+    rows = np.hstack((np.array([str(c) for c in classes])[:, np.newaxis],
+                      np.char.mod('%.6g', columns)))
+    overall = np.char.mod('%.6g', overall)
+    logger.debug('Estimated accuracy and area')
+
+    return np.vstack((header, rows, np.hstack((['Overall'], overall))))
+
+
 def main():
     """ Read input arguments, check them, then run script """
     # Raster map
@@ -211,13 +597,54 @@ def main():
     # Attribute in vector layer
     attribute = args['--attribute']
 
-    # Rasterize vector file
-    rasterized, raster_image, ndv = rasterize_map(
-        raster, vector, attribute, layer=layer)
+    # Bootstrap replicates, processes and seed
+    try:
+        bootstrap = args['--bootstrap']
+        bootstrap = int(bootstrap) if bootstrap is not None else None
+        processes = int(args['--processes'])
+        seed = int(args['--seed']) if args['--seed'] is not None else None
+    except ValueError:
+        logger.error('Bootstrap replicates, processes and seed must be '
+                     'integers')
+        sys.exit(1)
+    if bootstrap and not args['--stats']:
+        logger.error('Bootstrap intervals require --stats output file')
+        sys.exit(1)
 
-    # Crosstabulate
-    crosstab = crosstabulate(rasterized, raster_image, ndv=ndv)
+    # Number of threads
+    threads = args['--threads']
+    if threads is not None:
+        try:
+            threads = int(threads)
+        except ValueError:
+            logger.error('Number of threads must be an integer')
+            sys.exit(1)
 
+    if args['--points']:
+        # Read map at reference samples
+        reference, predicted, ndv = read_reference_pixels(
+            raster, vector, attribute, layer=layer)
+
+        # Crosstabulate
+        classes, tab = crosstabulate_points(reference, predicted, ndv=ndv)
+    else:
+        # Rasterize and crosstabulate one tile at a time
+        classes, tab = crosstabulate_tiles(raster, vector, attribute,
+                                           layer=layer, n_threads=threads)
+
+    # Estimate accuracy and area
+    if args['--stats']:
+        raster_ds, ndv = open_raster(raster)
+        stats = estimate_accuracy(classes, tab, raster_ds, ndv,
+                                  bootstrap=bootstrap,
+                                  n_processes=processes,
+                                  seed=seed)
+        print(stats)
+        with open(args['--stats'], 'w') as f:
+            np.savetxt(f, stats, fmt='%s', delimiter=',')
+        raster_ds = None
+
+    crosstab = format_crosstab(tab, classes)
     print(crosstab)
     with open(output, 'w') as f:
         np.savetxt(f, crosstab, fmt='%s', delimiter=',')
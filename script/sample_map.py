@@ -2,32 +2,73 @@
 """ Generate random sample of a map
 
 Usage:
-    sample_map.py [options] (simple | stratified | systematic) <map>
+    sample_map.py [options] (simple | stratified | systematic) <map>...
 
 Options:
     --allocation <allocation>   Sample allocation
     --size <n>                  Sample size for allocation [default: 500]
+    --users <accuracies>        Expected user's accuracy of all classes, or
+                                of each unmasked class
+    --se <se>                   Target standard error of overall accuracy
+                                [default: 0.01]
+    --minimum <n>               Minimum samples per class for "good_practices"
+                                allocation [default: 50]
     --mask <values>             Values to be excluded from sample [default: 0]
+    --bands <bands>             Bands of each <map> to sample, or "all"
+                                [default: 1]
+    --processes <n>             Number of processes for sampling more than
+                                one map [default: 1]
     --order                     Order or sort output samples by strata
     --ndv <NoDataValue>         NoDataValue for output raster [default: 255]
     --raster <filename>         Raster filename [default: sample.gtif]
     --rformat <format>          Raster file format [default: GTiff]
     --vector <filename>         Vector filename [default: sample.shp]
     --vformat <format>          Vector file format [default: ESRI Shapefile]
+    --geometry <geometry>       Vector geometry [default: polygon]
     --seed_val <seed_value>     Initial RNG seed value [default: None]
+    --engine <engine>           Sampling engine [default: memory]
+    --no_cache                  Do not read or write cached map histograms
     -v --verbose                Show verbose debugging messages
     -h --help                   Show help
 
 Sample size (--size) "<n>" options:
     <specified>                 Specify an integer for sample count
     variance                    Estimate sample count from variance formula
+                                using --users and --se
 
 Allocation (--allocation) "<allocation>" options:
     proportional                Allocation proportional to area
     good_practices              "Good Practices" allocation
     equal                       Equal allocation across classes
+    neyman                      Optimal allocation for overall accuracy from
+                                expected user's accuracy (--users)
     <specified>                 Comma or space separated list of integers
 
+Vector geometry (--geometry) "<geometry>" options:
+    polygon                     Pixel polygon of each sample
+    centroid                    Pixel center point of each sample
+    both                        Pixel polygons and center points as two layers
+
+Sampling engine (--engine) "<engine>" options:
+    memory                      Read entire map into memory before sampling
+    block                       Read map one block at a time in two passes
+    reservoir                   Read map one block at a time in one pass
+
+Systematic sampling (systematic):
+    Samples are taken from a grid with a random start, reading only the map
+    pixels on the grid. The grid spacing gives about --size unmasked samples
+    without --allocation; with --allocation the allocated number of grid
+    pixels are randomly kept from each class. Allocated samples, or samples
+    sized by variance, need the map class histogram, which is counted from
+    the whole map unless it is stored with the map or cached.
+
+Batch sampling (more than one <map> or band):
+    Each band of each <map> is sampled separately, with its own seed spawned
+    from --seed_val, reading each block of every map once in two passes split
+    among --processes. All maps must have the same number of rows and
+    columns, and --engine is not used. Outputs are named after each map and
+    band (e.g., sample_<map>_b1.gtif).
+
 Example:
 
     Output stratified random sample using specified allocation to a shapefile
@@ -38,6 +79,13 @@ Example:
     ... --raster output.gtif --vector samples.shp --seed 10000
     ... stratified input_map.gtif
 
+    Output a stratified random sample of each yearly map stacked as bands,
+        using 4 processes.
+
+    > sample_map.py -v --size 500 --allocation good_practices
+    ... --bands all --processes 4 --raster sample.gtif --vector None
+    ... stratified yearly_maps.gtif
+
 """
 from __future__ import print_function, division
 import logging
@@ -55,9 +103,18 @@ except:
     import ogr
     import osr
 
+# Shared modules are kept with the plugin source
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src'))
+from allocation import ALLOCATION_METHODS
+from histogram import (class_histogram, lookup_histogram, raster_histogram,
+                       write_histogram_cache)
+from rawraster import MemmapBand, mapped_band
+from samplers import ENGINES, sample, sample_batch
+
 __version__ = '0.1.0'
 
-_allocation_methods = ['proportional', 'equal', 'good_practices']
+_geometries = ['polygon', 'centroid', 'both']
 
 VERBOSE = False
 
@@ -82,224 +139,242 @@ def str2num(string):
     return v
 
 
-def random_stratified(image, classes, counts):
-    """
-    Return pixel strata, row, column from within image from a random stratified
-    sample of classes specified
+# GDAL data types for raster output, from smallest to largest
+_RASTER_TYPES = [('Byte', np.uint8), ('UInt16', np.uint16),
+                 ('Int16', np.int16), ('UInt32', np.uint32),
+                 ('Int32', np.int32), ('Float32', np.float32),
+                 ('Float64', np.float64)]
 
-    Args:
-        image (ndarray)         input map image
-        classes (ndarray)       map image classes to be sampled
-        counts (ndarray)        map image class sample counts
 
-    Return:
-        (strata, col, row)      tuple of ndarrays
+def _raster_type(strata, ndv):
     """
-    # Initialize outputs
-    strata = np.array([])
-    rows = np.array([])
-    cols = np.array([])
-
-    logger.debug('Performing sampling')
-
-    for c, n in zip(classes, counts):
-        logger.debug('Sampling class {c}'.format(c=c))
+    Return smallest GDAL data type holding every stratum and the NoDataValue
 
-        # Find pixels containing class c
-        row, col = np.where(image == c)
-
-        # Check for sample size > population size
-        if n > col.size:
-            logger.warning(
-                'Class {0} sample size larger than population'.format(c))
-            logger.warning('Reducing sample count to size of population')
-
-            n = col.size
-
-        # Randomly sample x / y without replacement
-        # NOTE: np.random.choice new to 1.7.0...
-        # TODO: check requirement and provide replacement
-        samples = np.random.choice(col.size, n, replace=False)
+    Args:
+        strata (ndarray)        sample strata
+        ndv (int or float)      NoDataValue for pixels without samples
 
-        logger.debug('    collected samples')
+    Returns:
+        (str, np.dtype)         GDAL data type name and matching NumPy type
+    """
+    values = np.append(np.unique(strata), ndv)
+    with np.errstate(invalid='ignore', over='ignore'):
+        for name, dtype in _RASTER_TYPES:
+            if np.all(values.astype(dtype) == values):
+                return (name, np.dtype(dtype))
+    return ('Float64', np.dtype(np.float64))
 
-        strata = np.append(strata, np.repeat(c, n))
-        rows = np.append(rows, row[samples])
-        cols = np.append(cols, col[samples])
 
-    return (strata, cols, rows)
+def batch_filename(output, map_fn, bidx):
+    """ Return output filename for one band of a map sampled in a batch
 
+    Args:
+        output (str)            output filename given for all maps
+        map_fn (str)            map image filename
+        bidx (int)              map image band number
 
-def random_simple(image, classes, count):
+    Returns:
+        str                     output filename suffixed with map name and
+                                band number
     """
-    Return pixel strata, row, column from within image from a simple random
-    sample of classes specified. The strata returned will be all equal to 1
-    because there are no strata in a non-stratified design.
+    root, ext = os.path.splitext(output)
+    name = os.path.splitext(os.path.basename(map_fn))[0]
+    return '{r}_{n}_b{b}{e}'.format(r=root, n=name, b=bidx, e=ext)
 
-    Args:
-        image (ndarray)         input map image
-        classes (ndarray)       map image classes to be sampled
-        counts (ndarray)        map image class sample counts
 
-    Return:
-        (strata, col, row)      tuple of ndarrays
+def write_raster_output(strata, cols, rows, map_ds, output,
+                        gdal_frmt='GTiff', ndv=255):
     """
-    # Check
-    if isinstance(count, np.ndarray):
-        if count.ndim > 1 or count[0].ndim > 1:
-            logger.error('Allocation for simple random sample must be one \
-                number')
-            logger.error('Allocation was:')
-            logger.error(count)
-            sys.exit(1)
-        else:
-            count = count[0]
+    Write samples to a raster with the same size and georeferencing as the map
 
-    logger.debug('Performing sampling')
+    Only the blocks of the output containing samples are written. GeoTIFF
+    outputs are tiled and created with SPARSE_OK so that all other blocks are
+    never written to disk and read as `ndv`. Other formats are filled with
+    `ndv` first. The output data type is the smallest that holds every
+    stratum and `ndv`.
 
-    # Find all pixels in `image` in `classes` and store locations
-    rows, cols = np.where(np.in1d(image, classes).reshape(image.shape))
+    Args:
+        strata (ndarray)        sample strata
+        cols (ndarray)          sample column numbers
+        rows (ndarray)          sample row numbers
+        map_ds (gdal.Dataset)   map image dataset
+        output (str)            output filename
+        gdal_frmt (str)         GDAL driver name for output
+        ndv (int or float)      NoDataValue for pixels without samples
+    """
+    strata = np.asarray(strata)
+    if np.any(strata == ndv):
+        logger.warning('NoDataValue {ndv} is also a sample stratum'.format(
+            ndv=ndv))
+    type_name, dtype = _raster_type(strata, ndv)
+    logger.debug('Writing raster output as {t}'.format(t=type_name))
 
-    if count > cols.size:
-        logger.error('Sample size greater than population of all classes \
-            included')
-        logger.error('Sample count: {n}'.format(n=count))
-        logger.error('Population size: {n}'.format(n=cols.size))
-        sys.exit(1)
+    # Get output driver
+    driver = gdal.GetDriverByName(gdal_frmt)
 
-    # Sample some of these locations
-    sample = np.random.choice(cols.size, count, replace=False)
-    logger.debug('    collected samples')
+    options = []
+    if gdal_frmt == 'GTiff':
+        options = ['TILED=YES', 'SPARSE_OK=TRUE']
 
-    return (np.ones(count), cols[sample], rows[sample])
+    # Create output dataset
+    sample_ds = driver.Create(output,
+                              map_ds.RasterXSize, map_ds.RasterYSize, 1,
+                              gdal.GetDataTypeByName(type_name),
+                              options=options)
+    band = sample_ds.GetRasterBand(1)
+    band.SetNoDataValue(ndv)
+    if gdal_frmt != 'GTiff':
+        band.Fill(ndv)
+
+    # Group samples by the output block containing them
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+
+    block_xsize, block_ysize = band.GetBlockSize()
+    n_xblocks = -(-map_ds.RasterXSize // block_xsize)
+    blocks = (rows // block_ysize) * n_xblocks + cols // block_xsize
+
+    order = np.argsort(blocks, kind='mergesort')
+    blocks, split = np.unique(blocks[order], return_index=True)
+
+    # Write out blocks containing samples
+    for block, idx in zip(blocks, np.split(order, split[1:])):
+        yoff = (block // n_xblocks) * block_ysize
+        xoff = (block % n_xblocks) * block_xsize
+        ysize = min(block_ysize, map_ds.RasterYSize - yoff)
+        xsize = min(block_xsize, map_ds.RasterXSize - xoff)
+
+        raster = np.full((ysize, xsize), ndv, dtype=dtype)
+        raster[rows[idx] - yoff, cols[idx] - xoff] = strata[idx]
+        band.WriteArray(raster, int(xoff), int(yoff))
 
+    # Port over metadata, projection, geotransform, etc
+    sample_ds.SetProjection(map_ds.GetProjection())
+    sample_ds.SetGeoTransform(map_ds.GetGeoTransform())
+    sample_ds.SetMetadata(map_ds.GetMetadata())
 
-def random_systematic(image, classes, counts):
-    """ """
-    raise NotImplementedError(
-        "Sorry - haven't added Systematic Sampling")
+    # Close
+    band = None
+    sample_ds = None
 
 
-def sample(image, method,
-           size=None, allocation=None,
-           mask=None, order=False):
+def _pixel_coords(cols, rows, gt, offsets):
     """
-    Make sampling decisions and perform sampling
+    Return map coordinates of points offset within pixels
 
     Args:
-      image (np.ndarray): 1 dimensional array of the image
-      method (str): Sampling method
-      size (int, optional): Total sample size
-      allocation (str, or list/np.ndarray): Allocation strategy specified as a
-        string, or user specified allocation as list or np.ndarray
-      mask (list or np.ndarray, optional): Values to exclude from `image`
-      order (bool, optional): Order the output by strata, or not
-
-    Returns:
-        output (tuple): strata, row numbers, and column numbers
+        cols (ndarray)          pixel column numbers
+        rows (ndarray)          pixel row numbers
+        gt (tuple)              raster geo-transform
+        offsets (list)          (column, row) offsets of points within pixel
 
+    Return:
+        (x, y)                  tuple of ndarrays of shape (n_pixel, n_offset)
     """
-    # Find map classes within image
-    classes = np.sort(np.unique(image))
-
-    # Exclude masked values
-    classes = classes[~np.in1d(classes, mask)]
-
-    logger.debug('Found {n} classes'.format(n=classes.size))
-    for c in classes:
-        px = np.sum(image == c)
-        logger.debug(
-            '    class {c} - {pix}px ({pct}%)'.format(
-                c=c,
-                pix=px,
-                pct=np.round(float(px) / image.size * 100.0, decimals=2)))
-
-    # Determine class counts from allocation type and total sample size
-    if allocation is None:
-        counts = size
-    elif isinstance(allocation, str):
-        # If allocationd determined by method, we must specify a size
-        if not isinstance(size, int):
-            raise TypeError('Must specify sample size if allocation to '
-                            'calculate allocation')
-        raise NotImplementedError(
-            "Sorry - haven't added any allocation types")
-
-    # Or use specified allocation
-    elif isinstance(allocation, list):
-        counts = np.array(allocation)
-    elif isinstance(allocation, np.ndarray):
-        if allocation.ndim != 1:
-            raise TypeError('Allocation must be 1D array')
-        counts = allocation
-    else:
-        raise TypeError(
-            'Allocation must be a str for a method, or a list/np.ndarray')
-
-    # Ensure we found allocation for each class if stratified random
-    if method == 'stratified':
-        if classes.size != counts.size:
-            raise ValueError(
-                'Sample counts must be given for each unmasked class in map')
+    offsets = np.asarray(offsets, dtype=np.float64)
+    col = np.asarray(cols, dtype=np.float64)[:, np.newaxis] + offsets[:, 0]
+    row = np.asarray(rows, dtype=np.float64)[:, np.newaxis] + offsets[:, 1]
 
-    # Perform sample using desired method
-    if method == 'stratified':
-        strata, cols, rows = random_stratified(image, classes, counts)
-    elif method == 'random':
-        strata, cols, rows = random_simple(image, classes, counts)
-    elif method == 'systematic':
-        strata, cols, rows = random_systematic(image, classes, counts)
+    x = gt[0] + col * gt[1] + row * gt[2]
+    y = gt[3] + col * gt[4] + row * gt[5]
 
-    # Randomize samples if not ordered
-    if order is not True:
-        logger.debug('Randomizing order of samples')
-        sort_index = np.random.choice(strata.size, strata.size, replace=False)
+    return (x, y)
 
-        strata = strata[sort_index]
-        cols = cols[sort_index]
-        rows = rows[sort_index]
 
-    return (strata, cols, rows)
+def _polygon_wkb(x, y):
+    """
+    Return little endian WKB of single ring polygons
 
+    Args:
+        x (ndarray)             ring x coordinates of shape (n, n_vertex)
+        y (ndarray)             ring y coordinates of shape (n, n_vertex)
 
-def write_raster_output(strata, cols, rows, map_ds, output,
-                        gdal_frmt='GTiff', ndv=255):
+    Return:
+        wkb (list)              WKB of each polygon as bytes
     """
+    n, n_vertex = x.shape
+    wkb = np.zeros(n, dtype=[('order', 'u1'),
+                             ('type', '<u4'),
+                             ('n_rings', '<u4'),
+                             ('n_vertex', '<u4'),
+                             ('xy', '<f8', (n_vertex, 2))])
+    wkb['order'] = 1
+    wkb['type'] = ogr.wkbPolygon
+    wkb['n_rings'] = 1
+    wkb['n_vertex'] = n_vertex
+    wkb['xy'][..., 0] = x
+    wkb['xy'][..., 1] = y
+
+    wkb = wkb.view(np.uint8).reshape(n, wkb.dtype.itemsize)
+    return [w.tobytes() for w in wkb]
+
+
+def _point_wkb(x, y):
     """
-    # Init and fill output array with samples
-    raster = np.ones((map_ds.RasterYSize, map_ds.RasterXSize),
-                     dtype=np.uint8) * ndv
+    Return little endian WKB of points
 
-    for s, c, r in zip(strata, cols, rows):
-        raster[r, c] = s
+    Args:
+        x (ndarray)             point x coordinates
+        y (ndarray)             point y coordinates
 
-    # Get output driver
-    driver = gdal.GetDriverByName(gdal_frmt)
+    Return:
+        wkb (list)              WKB of each point as bytes
+    """
+    n = x.size
+    wkb = np.zeros(n, dtype=[('order', 'u1'),
+                             ('type', '<u4'),
+                             ('xy', '<f8', (2, ))])
+    wkb['order'] = 1
+    wkb['type'] = ogr.wkbPoint
+    wkb['xy'][:, 0] = x.ravel()
+    wkb['xy'][:, 1] = y.ravel()
 
-    # Create output dataset
-    sample_ds = driver.Create(output,
-                              map_ds.RasterXSize, map_ds.RasterYSize, 1,
-                              gdal.GetDataTypeByName('Byte'))
+    wkb = wkb.view(np.uint8).reshape(n, wkb.dtype.itemsize)
+    return [w.tobytes() for w in wkb]
 
-    # Write out band
-    sample_ds.GetRasterBand(1).SetNoDataValue(ndv)
-    sample_ds.GetRasterBand(1).WriteArray(raster)
 
-    # Port over metadata, projection, geotransform, etc
-    sample_ds.SetProjection(map_ds.GetProjection())
-    sample_ds.SetGeoTransform(map_ds.GetGeoTransform())
-    sample_ds.SetMetadata(map_ds.GetMetadata())
+def _create_sample_layer(sample_ds, name, map_sr, geom_type):
+    """ Create layer for samples with ID, ROW, COL and STRATUM fields """
+    layer = sample_ds.CreateLayer(name, map_sr, geom_type=geom_type)
 
-    # Close
-    sample_ds = None
+    # Add fields for layer
+    # Sample ID field
+    layer.CreateField(ogr.FieldDefn('ID', ogr.OFTInteger))
+    # Row/Col fields
+    layer.CreateField(ogr.FieldDefn('ROW', ogr.OFTInteger))
+    layer.CreateField(ogr.FieldDefn('COL', ogr.OFTInteger))
+    # Strata field
+    layer.CreateField(ogr.FieldDefn('STRATUM', ogr.OFTInteger))
+
+    return layer
 
 
 def write_vector_output(strata, cols, rows, map_ds, output,
-                        ogr_frmt='ESRI Shapefile'):
+                        ogr_frmt='ESRI Shapefile', geometry='polygon',
+                        batch_size=10000):
     """
+    Write the pixel polygon or centroid of each sample to a vector file
+
+    Geometries are built together as WKB and written in transactions of
+    `batch_size` features when supported by the format. If `geometry` is
+    "both", centroids are written to a "sample_centroid" layer alongside the
+    "sample" polygon layer, or to a separate file suffixed "_centroid" if the
+    format supports only one layer per file (e.g., "ESRI Shapefile").
+
+    Args:
+        strata (ndarray)        sample strata
+        cols (ndarray)          sample column numbers
+        rows (ndarray)          sample row numbers
+        map_ds (gdal.Dataset)   map image dataset
+        output (str)            output filename
+        ogr_frmt (str)          OGR driver name for output
+        geometry (str)          output geometry - "polygon", "centroid", or
+                                "both"
+        batch_size (int)        number of features written per transaction
     """
-    # Corners of pixel in pixel coordinates
+    # Corners and center of pixel in pixel coordinates
     corners = [(0, 0), (1, 0), (1, 1), (0, 1), (0, 0)]
+    center = [(0.5, 0.5)]
 
     # Raster geo-transform
     gt = map_ds.GetGeoTransform()
@@ -309,57 +384,93 @@ def write_vector_output(strata, cols, rows, map_ds, output,
 
     # Get OGR driver
     driver = ogr.GetDriverByName(ogr_frmt)
-    # Create OGR dataset and layer
+    # Create OGR dataset and layers
     sample_ds = driver.CreateDataSource(output)
-    layer = sample_ds.CreateLayer('sample', map_sr, geom_type=ogr.wkbPolygon)
 
-    # Add fields for layer
-    # Sample ID field
-    layer.CreateField(ogr.FieldDefn('ID', ogr.OFTInteger))
-    # Row/Col fields
-    layer.CreateField(ogr.FieldDefn('ROW', ogr.OFTInteger))
-    layer.CreateField(ogr.FieldDefn('COL', ogr.OFTInteger))
-    # Strata field
-    layer.CreateField(ogr.FieldDefn('STRATUM', ogr.OFTInteger))
+    if geometry in ('polygon', 'both'):
+        layer = _create_sample_layer(sample_ds, 'sample', map_sr,
+                                     ogr.wkbPolygon)
+
+        # Build all geometries at once
+        x, y = _pixel_coords(cols, rows, gt, corners)
+        _write_features(layer, _polygon_wkb(x, y), strata, cols, rows,
+                        batch_size)
+        layer = None
+
+    if geometry in ('centroid', 'both'):
+        centroid_ds = sample_ds
+        name = 'sample'
+        if geometry == 'both':
+            name = 'sample_centroid'
+            if not sample_ds.TestCapability(ogr.ODsCCreateLayer):
+                root, ext = os.path.splitext(output)
+                centroid_output = root + '_centroid' + ext
+                if os.path.exists(centroid_output):
+                    driver.DeleteDataSource(centroid_output)
+                centroid_ds = driver.CreateDataSource(centroid_output)
+
+        layer = _create_sample_layer(centroid_ds, name, map_sr,
+                                     ogr.wkbPoint)
+
+        x, y = _pixel_coords(cols, rows, gt, center)
+        _write_features(layer, _point_wkb(x, y), strata, cols, rows,
+                        batch_size)
+        layer = None
+        centroid_ds = None
+
+    sample_ds = None
 
-    # Loop through samples adding to layer
-    for i, (stratum, col, row) in enumerate(zip(strata, cols, rows)):
-        # Feature
-        feature = ogr.Feature(layer.GetLayerDefn())
-        feature.SetField('ID', i)
-        feature.SetField('ROW', row)
-        feature.SetField('COL', col)
-        feature.SetField('STRATUM', stratum)
 
-        # Geometry
-        ring = ogr.Geometry(type=ogr.wkbLinearRing)
+def _write_features(layer, geoms, strata, cols, rows, batch_size=10000):
+    """
+    Write sample features to a layer in batched transactions
 
-        for corner in corners:
-            ring.AddPoint(
-                gt[0] + (col + corner[0]) * gt[1] + (row + corner[1]) * gt[2],
-                gt[3] + (col + corner[1]) * gt[4] + (row + corner[1]) * gt[5])
-        square = ogr.Geometry(type=ogr.wkbPolygon)
-        square.AddGeometry(ring)
+    Args:
+        layer (ogr.Layer)       layer with ID, ROW, COL and STRATUM fields
+        geoms (list)            WKB geometry of each sample
+        strata (ndarray)        sample strata
+        cols (ndarray)          sample column numbers
+        rows (ndarray)          sample row numbers
+        batch_size (int)        number of features written per transaction
+    """
+    defn = layer.GetLayerDefn()
+    fields = [defn.GetFieldIndex(name)
+              for name in ('ID', 'ROW', 'COL', 'STRATUM')]
+    transactions = layer.TestCapability(ogr.OLCTransactions)
 
-        feature.SetGeometry(square)
+    # Python scalars are much faster to set than NumPy scalars
+    records = list(zip(range(len(geoms)),
+                       np.asarray(rows).tolist(),
+                       np.asarray(cols).tolist(),
+                       np.asarray(strata).tolist()))
 
-        layer.CreateFeature(feature)
+    for start in range(0, len(geoms), batch_size):
+        if transactions:
+            layer.StartTransaction()
 
-        feature.Destroy()
+        for record, geom in zip(records[start:start + batch_size],
+                                geoms[start:start + batch_size]):
+            feature = ogr.Feature(defn)
+            for field, value in zip(fields, record):
+                feature.SetField(field, value)
+            feature.SetGeometryDirectly(ogr.CreateGeometryFromWkb(geom))
+            layer.CreateFeature(feature)
 
-    sample_ds = None
+        if transactions:
+            layer.CommitTransaction()
 
 
 def main():
     """ Read in arguments, test them, then sample map """
     ### Read in and test arguments
     # Read in inputs
-    image_fn = args['<map>']
-    if not os.path.isfile(image_fn):
-        logger.error(
-            'Specified <map> file {f} does not exist'.format(f=image_fn))
-        sys.exit(1)
-    logger.debug('Using map image {f}'.format(f=image_fn))
+    image_fns = args['<map>']
+    for image_fn in image_fns:
+        if not os.path.isfile(image_fn):
+            logger.error(
+                'Specified <map> file {f} does not exist'.format(f=image_fn))
+            sys.exit(1)
+        logger.debug('Using map image {f}'.format(f=image_fn))
 
     # Sampling method
     if args['simple']:
@@ -374,21 +485,51 @@ def main():
     logger.debug('Sampling method is {m}'.format(m=method))
 
     # Sample size
+    size = args['--size']
+    if size != 'variance':
+        try:
+            size = int(size)
+        except:
+            logger.error('Sample size must be an integer or "variance"')
+            sys.exit(1)
+    logger.debug('Sample size is {n}'.format(n=size))
+
+    # Expected user's accuracy
+    users_accuracy = args['--users']
+    if users_accuracy is not None:
+        try:
+            users_accuracy = np.array([float(u) for u in
+                                       users_accuracy.replace(',', ' ').
+                                       split(' ') if u != ''])
+        except:
+            logger.error("Expected user's accuracy (--users) must be a "
+                         "sequence of numbers separated by commas or spaces")
+            sys.exit(1)
+        if users_accuracy.size == 1:
+            users_accuracy = users_accuracy[0]
+    if users_accuracy is None and (size == 'variance' or
+                                   args['--allocation'] == 'neyman'):
+        logger.error("Must specify expected user's accuracy (--users) for "
+                     "variance sample size or neyman allocation")
+        sys.exit(1)
+
+    # Target standard error and minimum samples per class
     try:
-        size = int(args['--size'])
+        target_se = float(args['--se'])
+        minimum = int(args['--minimum'])
     except:
-        logger.error('Sample size must be an integer')
+        logger.error('Target standard error (--se) must be a number and '
+                     'minimum samples (--minimum) must be an integer')
         sys.exit(1)
-    logger.debug('Sample size is {n}'.format(n=size))
 
     # Test if allocation is built-in; if not then it needs to be list of ints
     allocation = args['--allocation']
     if allocation is None:
-        if method != 'random':
-            logger.error('Must specify allocation for designs other than\
-                simple random sampling')
+        if method == 'stratified':
+            logger.error('Must specify allocation for stratified random '
+                         'sampling')
             sys.exit(1)
-    elif args['--allocation'] not in _allocation_methods:
+    elif args['--allocation'] not in ALLOCATION_METHODS:
         try:
             allocation = np.array([str2num(i) for i in
                                    allocation.replace(',', ' ').split(' ') if
@@ -400,6 +541,10 @@ def main():
             sys.exit(1)
 
         # Make sure size lines up with how many allocated
+        if size == 'variance':
+            logger.error('Cannot estimate sample size for a specified '
+                         'allocation')
+            sys.exit(1)
         if size != allocation.sum():
             logger.error(
                 'Number of samples in specified allocation {n} does not equal '
@@ -407,9 +552,6 @@ def main():
                                                    s=size))
             sys.exit(1)
 
-    else:
-        raise NotImplementedError("Sorry - haven't added allocation methods")
-
     if allocation is not None:
         logger.debug('Allocation is {a}'.format(a=allocation))
 
@@ -434,6 +576,24 @@ def main():
     # Should we order output by strata?
     order = args['--order']
 
+    # Bands of each map
+    bands = args['--bands']
+    if bands.lower() != 'all':
+        try:
+            bands = [int(b) for b in bands.replace(',', ' ').split(' ')
+                     if b != '']
+        except:
+            logger.error('Bands (--bands) must be "all" or a sequence of '
+                         'integers separated by commas or spaces')
+            sys.exit(1)
+
+    # Number of processes for batch sampling
+    try:
+        processes = int(args['--processes'])
+    except:
+        logger.error('Number of processes (--processes) must be an integer')
+        sys.exit(1)
+
     # NoDataValue
     ndv = args['--ndv']
     try:
@@ -455,6 +615,44 @@ def main():
     gdal_frmt = args['--rformat']
     ogr_frmt = args['--vformat']
 
+    # Output vector geometry
+    geometry = args['--geometry']
+    if geometry not in _geometries:
+        logger.error('Vector geometry must be one of: {g}'.format(
+            g=', '.join(_geometries)))
+        sys.exit(1)
+
+    # Open each map and list the bands to sample
+    image_ds = {}
+    maps = []
+    for image_fn in image_fns:
+        try:
+            image_ds[image_fn] = gdal.Open(image_fn, gdal.GA_ReadOnly)
+        except:
+            logger.error('Could not open {f}'.format(f=image_fn))
+            sys.exit(1)
+        n_bands = image_ds[image_fn].RasterCount
+        for bidx in (range(1, n_bands + 1) if bands == 'all' else bands):
+            if bidx < 1 or bidx > n_bands:
+                logger.error('Band {b} does not exist in {f}'.format(
+                    b=bidx, f=image_fn))
+                sys.exit(1)
+            maps.append((image_fn, bidx))
+    logger.debug('Sampling {n} maps'.format(n=len(maps)))
+
+    # Output filenames of each map
+    if len(maps) == 1:
+        outputs = [(output_raster, output_vector)]
+    else:
+        outputs = [(output_raster and batch_filename(output_raster, f, b),
+                    output_vector and batch_filename(output_vector, f, b))
+                   for f, b in maps]
+        names = [name for output in outputs for name in output if name]
+        if len(set(names)) < len(names):
+            logger.error('Cannot name outputs of each map because maps '
+                         'share a file name or band')
+            sys.exit(1)
+
     # Test output drivers if corresponding filnames aren't None
     if output_raster:
         gdal_driver = gdal.GetDriverByName(gdal_frmt)
@@ -478,13 +676,14 @@ def main():
         logger.debug('Writing output vector to {f} ({ff})'.format(
             f=output_vector, ff=ogr_frmt))
 
-        if os.path.exists(output_vector):
-            try:
-                ogr_driver.DeleteDataSource(output_vector)
-            except:
-                logger.error('Cannot overwrite existing output vector '
-                             'file {f}'.format(f=output_vector))
-                sys.exit(1)
+        for _, vector_fn in outputs:
+            if os.path.exists(vector_fn):
+                try:
+                    ogr_driver.DeleteDataSource(vector_fn)
+                except:
+                    logger.error('Cannot overwrite existing output vector '
+                                 'file {f}'.format(f=vector_fn))
+                    sys.exit(1)
 
     gdal_driver = None
     ogr_driver = None
@@ -499,40 +698,101 @@ def main():
         except:
             logger.error("Seed value must be an integer")
             sys.exit(1)
-        np.random.seed(seed)
-        logger.debug('Setting NumPy seed to {s}'.format(s=seed))
+        logger.debug('Using seed value {s}'.format(s=seed))
 
-    ### Finally do some real work
-    # Read in image
-    try:
-        image_ds = gdal.Open(image_fn, gdal.GA_ReadOnly)
-    except:
-        logger.error('Could not open {f}'.format(f=image_fn))
+    # Sampling engine
+    engine = args['--engine']
+    if engine not in ENGINES:
+        logger.error('Sampling engine must be one of: {e}'.format(
+            e=', '.join(ENGINES)))
         sys.exit(1)
+    logger.debug('Sampling engine is {e}'.format(e=engine))
 
-    image = image_ds.GetRasterBand(1).ReadAsArray()
-    logger.debug('Read in map image to be sampled')
+    # Map class histogram cache
+    use_cache = not args['--no_cache']
 
-    # Do the sampling
-    strata, cols, rows = sample(image, method,
-                                size=size,
-                                allocation=allocation,
-                                mask=mask,
-                                order=order)
-    logger.debug('Finished collecting samples')
+    ### Finally do some real work
+    if len(maps) > 1:
+        logger.debug('Sampling maps together using {n} processes'.format(
+            n=processes))
+        try:
+            samples = sample_batch(maps, method,
+                                   size=size,
+                                   allocation=allocation,
+                                   mask=mask,
+                                   order=order,
+                                   users_accuracy=users_accuracy,
+                                   target_se=target_se,
+                                   minimum=minimum,
+                                   seed=seed,
+                                   n_processes=processes)
+        except (TypeError, ValueError) as e:
+            logger.error(str(e))
+            sys.exit(1)
+        logger.debug('Finished collecting samples')
+    else:
+        image_fn, bidx = maps[0]
+
+        # Uncompressed maps are read from a memory-mapped view of the file
+        band = mapped_band(image_ds[image_fn].GetRasterBand(bidx))
+        if isinstance(band, MemmapBand):
+            logger.debug('Memory-mapped map image')
+        histogram = lookup_histogram(band, cache=use_cache)
+        if histogram is not None:
+            logger.debug('Using stored or cached map class histogram')
+
+        if engine in ('block', 'reservoir') or method == 'systematic':
+            image = band
+            logger.debug('Reading map image to be sampled by block or grid')
+            # Unstratified systematic samples read only the grid
+            if method == 'systematic':
+                counted = allocation is not None or size == 'variance'
+            else:
+                counted = engine == 'block'
+            if counted and histogram is None:
+                histogram = raster_histogram(band, cache=use_cache)
+        else:
+            image = band.ReadAsArray()
+            logger.debug('Read in map image to be sampled')
+            if histogram is None:
+                histogram = class_histogram(image)
+                if use_cache:
+                    write_histogram_cache(band, histogram)
+
+        # Do the sampling
+        try:
+            samples = [sample(image, method,
+                              size=size,
+                              allocation=allocation,
+                              mask=mask,
+                              order=order,
+                              engine=engine,
+                              histogram=histogram,
+                              users_accuracy=users_accuracy,
+                              target_se=target_se,
+                              minimum=minimum,
+                              seed=seed)]
+        except (TypeError, ValueError) as e:
+            logger.error(str(e))
+            sys.exit(1)
+        logger.debug('Finished collecting samples')
 
-    image = None
+        image = None
 
     # Write outputs
-    if output_raster is not None:
-        logger.debug('Writing raster output to {f}'.format(f=output_raster))
-        write_raster_output(strata, cols, rows,
-                            image_ds, output_raster, gdal_frmt, ndv)
-
-    if output_vector is not None:
-        logger.debug('Writing vector output to {f}'.format(f=output_vector))
-        write_vector_output(strata, cols, rows,
-                            image_ds, output_vector, ogr_frmt)
+    for (image_fn, bidx), records, (raster_fn, vector_fn) in zip(
+            maps, samples, outputs):
+        if raster_fn is not None:
+            logger.debug('Writing raster output to {f}'.format(f=raster_fn))
+            write_raster_output(records['stratum'], records['col'],
+                                records['row'], image_ds[image_fn],
+                                raster_fn, gdal_frmt, ndv)
+
+        if vector_fn is not None:
+            logger.debug('Writing vector output to {f}'.format(f=vector_fn))
+            write_vector_output(records['stratum'], records['col'],
+                                records['row'], image_ds[image_fn],
+                                vector_fn, ogr_frmt, geometry=geometry)
 
     logger.debug('Sampling complete')
 
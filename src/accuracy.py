@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ AccuracySampler
+
+ Plugin for generating random samples from maps for accuracy assessment
+                             -------------------
+        begin                : 2014-07-30
+        copyright            : (C) 2014 by Chris Holden
+        email                : ceholden@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Accuracy and area estimates from error matrices of a stratified random
+ sample with map classes as strata, following:
+
+    Olofsson, P., Foody, G. M., Herold, M., Stehman, S. V., Woodcock, C. E.,
+    and Wulder, M. A. (2014). Good practices for estimating area and
+    assessing accuracy of land change. Remote Sensing of Environment, 148,
+    42-57.
+
+ Error matrices are arranged as in ``crosstab.py``, with reference classes
+ as rows and map classes as columns. Every estimator also accepts a stack of
+ error matrices shaped (..., n_class, n_class) and returns estimates for
+ each matrix in the stack.
+"""
+from __future__ import division
+
+import logging
+import multiprocessing
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Normal distribution quantile for 95% confidence intervals
+Z_95 = 1.959964
+
+# Largest number of resampled samples held in memory at once per process
+_BOOTSTRAP_CHUNK = 2 ** 22
+
+# Statistics with bootstrap intervals
+_BOOTSTRAP_STATS = ['overall', 'users', 'producers', 'area']
+
+
+def error_matrix(reference, predicted, classes):
+    """ Count pairs of reference and map class
+
+    Args:
+      reference (ndarray):      reference class of each sample
+      predicted (ndarray):      map class of each sample
+      classes (ndarray):        sorted classes of the error matrix, which must
+                                include every value in `reference` and
+                                `predicted`
+
+    Returns:
+      tab (ndarray):            error matrix with reference classes as rows
+                                and map classes as columns
+
+    """
+    k = classes.size
+    ref_index = np.searchsorted(classes, reference).astype(np.int64)
+    map_index = np.searchsorted(classes, predicted).astype(np.int64)
+
+    tab = np.bincount(ref_index * k + map_index, minlength=k * k)
+
+    return tab.reshape(k, k)
+
+
+def class_weights(classes, histogram, nodata=None):
+    """ Return proportion of map area in each class
+
+    Args:
+      classes (ndarray):        classes of the error matrix
+      histogram (tuple):        classes and pixel count of each class in the
+                                map (e.g., from `histogram.raster_histogram`)
+      nodata (list, optional):  map values excluded from area of map
+
+    Returns:
+      weights (ndarray):        proportion of map in each class of `classes`
+
+    """
+    map_classes, counts = histogram
+    if nodata is not None:
+        valid = ~np.isin(map_classes, nodata)
+        map_classes, counts = map_classes[valid], counts[valid]
+
+    weights = np.zeros(np.size(classes))
+    if map_classes.size:
+        idx = np.clip(np.searchsorted(map_classes, classes),
+                      0, map_classes.size - 1)
+        found = map_classes[idx] == classes
+        weights[found] = counts[idx[found]]
+
+    return weights / counts.sum()
+
+
+def accuracy_stats(tab, weights):
+    """ Estimate accuracy and area from error matrices of a stratified sample
+
+    Sampling strata are the map classes, with `weights` giving the proportion
+    of the map in each stratum. Estimates are NaN where undefined (e.g., for
+    classes without samples). Strata with fewer than two samples or without
+    map area add nothing to the variance of other estimates, and only their
+    own user's accuracy standard error is NaN.
+
+    Args:
+      tab (ndarray):            error matrix, or stack of error matrices,
+                                with reference classes as rows and map
+                                classes as columns
+      weights (ndarray):        proportion of map area in each map class
+
+    Returns:
+      stats (dict):             estimates and their standard errors:
+                                "proportions" (estimated proportion of area in
+                                each cell, with map classes as rows),
+                                "overall" and "overall_se" (overall accuracy),
+                                "users" and "users_se" (user's accuracy),
+                                "producers" and "producers_se" (producer's
+                                accuracy), "area" and "area_se" (proportion of
+                                area in each reference class)
+
+    """
+    # Arrange as Olofsson et al. with map classes as rows
+    n = np.swapaxes(np.asarray(tab, dtype=np.float64), -1, -2)
+    w = np.asarray(weights, dtype=np.float64)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        n_map = n.sum(axis=-1)
+        # Proportion of samples in each map class within each reference class
+        p_row = n / n_map[..., np.newaxis]
+        p = w[..., np.newaxis] * p_row
+
+        # Strata without samples contribute nothing to area estimates
+        p = np.where(np.isnan(p), 0, p)
+
+        # Strata without area or with too few samples for a variance
+        #   contribute nothing to variance estimates
+        usable = (w > 0) & (n_map >= 2)
+        p_row_var = np.where(
+            usable[..., np.newaxis],
+            p_row * (1 - p_row) / (n_map[..., np.newaxis] - 1), 0)
+
+        diag = np.diagonal(p, axis1=-2, axis2=-1)
+        p_map = p.sum(axis=-1)
+        p_ref = p.sum(axis=-2)
+
+        overall = diag.sum(axis=-1)
+        users = diag / p_map
+        producers = diag / p_ref
+
+        # Variance of user's accuracy and overall accuracy
+        users_var = users * (1 - users) / (n_map - 1)
+        stratum_var = np.where(usable, users_var, 0)
+        overall_var = np.sum(w ** 2 * stratum_var, axis=-1)
+
+        # Variance of area proportion of each reference class
+        area_var = np.sum((w ** 2)[..., np.newaxis] * p_row_var, axis=-2)
+
+        # Variance of producer's accuracy
+        others = area_var - w ** 2 * np.diagonal(p_row_var, axis1=-2,
+                                                 axis2=-1)
+        producers_var = (w ** 2 * (1 - producers) ** 2 * stratum_var +
+                         producers ** 2 * others) / p_ref ** 2
+
+    return {
+        'proportions': p,
+        'overall': overall,
+        'overall_se': np.sqrt(overall_var),
+        'users': users,
+        'users_se': np.sqrt(users_var),
+        'producers': producers,
+        'producers_se': np.sqrt(producers_var),
+        'area': p_ref,
+        'area_se': np.sqrt(area_var)
+    }
+
+
+def confidence_interval(estimate, se, z=Z_95):
+    """ Return lower and upper bounds of normal confidence intervals
+
+    Args:
+      estimate (ndarray):       estimates
+      se (ndarray):             standard errors of estimates
+      z (float, optional):      normal quantile (default: 95% interval)
+
+    Returns:
+      lower, upper (tuple):     ndarray of lower and upper bounds
+
+    """
+    return (estimate - z * se, estimate + z * se)
+
+
+def bootstrap_error_matrices(tab, n_replicates, seed=None):
+    """ Return error matrices of stratified bootstrap resamples
+
+    Samples are resampled with replacement within each map class stratum,
+    keeping the number of samples in each stratum. Resampled indices for
+    every replicate are drawn at once and all error matrices are counted
+    with one ``np.bincount``.
+
+    Args:
+      tab (ndarray):            error matrix with reference classes as rows
+                                and map classes as columns
+      n_replicates (int):       number of bootstrap replicates
+      seed (int or SeedSequence, optional): seed for RNG
+
+    Returns:
+      tabs (ndarray):           error matrices of each replicate, shaped
+                                (n_replicates, n_class, n_class)
+
+    """
+    rng = np.random.default_rng(seed)
+    k = tab.shape[0]
+
+    # Expand error matrix into samples sorted by map class stratum
+    cells = np.arange(k * k).reshape(k, k).T.ravel()
+    codes = np.repeat(cells, tab.T.ravel().astype(np.int64))
+    n_strata = tab.sum(axis=0).astype(np.int64)
+    start = np.concatenate(([0], np.cumsum(n_strata)[:-1]))
+
+    # Random sample index within each stratum for each replicate
+    stratum_start = np.repeat(start, n_strata)
+    stratum_size = np.repeat(n_strata, n_strata)
+    idx = stratum_start + (rng.random((n_replicates, codes.size)) *
+                           stratum_size).astype(np.int64)
+
+    offset = np.arange(n_replicates, dtype=np.int64)[:, np.newaxis] * k * k
+    tabs = np.bincount((codes[idx] + offset).ravel(),
+                       minlength=n_replicates * k * k)
+
+    return tabs.reshape(n_replicates, k, k)
+
+
+def _bootstrap_chunk(args):
+    """ Return statistics of a chunk of bootstrap replicates """
+    tab, weights, n_replicates, seed = args
+    stats = accuracy_stats(bootstrap_error_matrices(tab, n_replicates, seed),
+                           weights)
+    return dict((key, stats[key]) for key in _BOOTSTRAP_STATS)
+
+
+def bootstrap_intervals(tab, weights, n_replicates=1000, alpha=0.05,
+                        n_processes=1, seed=None):
+    """ Return bootstrap percentile intervals of accuracy and area estimates
+
+    Replicates are computed in chunks that bound memory use, and chunks may
+    be divided among a pool of processes.
+
+    Args:
+      tab (ndarray):            error matrix with reference classes as rows
+                                and map classes as columns
+      weights (ndarray):        proportion of map area in each map class
+      n_replicates (int, optional): number of bootstrap replicates
+      alpha (float, optional):  intervals cover 1 - alpha of replicates
+      n_processes (int, optional):  number of processes
+      seed (int, optional):     seed for RNG
+
+    Returns:
+      intervals (dict):         lower and upper bounds of "overall", "users",
+                                "producers" and "area" estimates
+
+    """
+    n_samples = max(int(np.sum(tab)), 1)
+    chunk = max(1, min(n_replicates, _BOOTSTRAP_CHUNK // n_samples))
+    sizes = [min(chunk, n_replicates - i)
+             for i in range(0, n_replicates, chunk)]
+
+    # Independent random number stream for each chunk
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    jobs = [(tab, weights, size, s) for size, s in zip(sizes, seeds)]
+
+    logger.debug('Computing {n} bootstrap replicates in {c} chunks'.format(
+        n=n_replicates, c=len(jobs)))
+    if n_processes > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(n_processes)
+        try:
+            results = pool.map(_bootstrap_chunk, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_bootstrap_chunk(job) for job in jobs]
+
+    q = [100 * alpha / 2, 100 * (1 - alpha / 2)]
+    intervals = {}
+    for key in _BOOTSTRAP_STATS:
+        replicates = np.concatenate([np.atleast_1d(r[key]) for r in results])
+        intervals[key] = tuple(np.nanpercentile(replicates, q, axis=0))
+
+    return intervals
@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ AccuracySampler
+
+ Plugin for generating random samples from maps for accuracy assessment
+                             -------------------
+        begin                : 2014-07-30
+        copyright            : (C) 2014 by Chris Holden
+        email                : ceholden@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Allocation of samples to map class strata and sample size estimation for
+ stratified random samples, following:
+
+    Olofsson, P., Foody, G. M., Herold, M., Stehman, S. V., Woodcock, C. E.,
+    and Wulder, M. A. (2014). Good practices for estimating area and
+    assessing accuracy of land change. Remote Sensing of Environment, 148,
+    42-57.
+
+ Allocations are computed with array operations over all classes at once so
+ they are cheap enough to recompute whenever inputs change.
+"""
+from __future__ import division
+
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ALLOCATION_METHODS = ['proportional', 'equal', 'good_practices', 'neyman']
+
+# Default minimum number of samples per class for "good practices"
+GOOD_PRACTICES_MINIMUM = 50
+
+
+def _as_weights(weights):
+    """ Return `weights` as float array normalized to sum to one """
+    weights = np.asarray(weights, dtype=np.float64)
+    total = weights.sum()
+    if total <= 0:
+        raise ValueError('Class weights must sum to a positive number')
+    return weights / total
+
+
+def _users_accuracy(users_accuracy, n_class):
+    """ Return expected user's accuracy of each class
+
+    Args:
+      users_accuracy (float or ndarray): expected user's accuracy of all
+                                classes, or of each class
+      n_class (int):            number of classes
+
+    Returns:
+      users (ndarray):          expected user's accuracy of each class
+
+    """
+    users = np.asarray(users_accuracy, dtype=np.float64)
+    if users.ndim == 0:
+        users = np.repeat(users, n_class)
+    if users.shape != (n_class, ):
+        raise ValueError('Expected user\'s accuracy must be given for all '
+                         'classes or for each class ({n})'.format(n=n_class))
+    if np.any((users < 0) | (users > 1)):
+        raise ValueError('Expected user\'s accuracy must be between 0 and 1')
+
+    return users
+
+
+def _quota_scale(quota, n, lower, upper):
+    """ Return scale giving clipped quotas summing to `n`
+
+    Finds `scale` such that ``np.clip(scale * quota, lower, upper).sum()``
+    equals `n`. The clipped sum is piecewise linear in `scale`, with
+    breakpoints where each quota reaches its lower or upper bound, so it is
+    evaluated at every sorted breakpoint using cumulative sums.
+
+    Args:
+      quota (ndarray):          nonnegative quota of each class
+      n (int):                  number of samples
+      lower (ndarray):          minimum of each class
+      upper (ndarray):          maximum of each class, which may be infinite
+
+    Returns:
+      scale (float):            scale applied to `quota`
+
+    """
+    pos = quota > 0
+    q, lo, hi = quota[pos], lower[pos], upper[pos]
+    capped = np.isfinite(hi)
+
+    # Changes in slope and intercept of the clipped sum at each breakpoint
+    t = np.concatenate((lo / q, hi[capped] / q[capped]))
+    d_slope = np.concatenate((q, -q[capped]))
+    d_const = np.concatenate((-lo, hi[capped]))
+    order = np.argsort(t, kind='mergesort')
+    t, d_slope, d_const = t[order], d_slope[order], d_const[order]
+
+    slope = np.cumsum(d_slope)
+    const = lower.sum() + np.cumsum(d_const)
+    total = const + slope * t
+
+    j = int(np.searchsorted(total, n))
+    if j == 0 and t.size:
+        return t[0]
+    if j == 0 or (j == t.size and capped.all()):
+        raise ValueError('Cannot allocate {n} samples to classes with '
+                         'nonzero quotas'.format(n=n))
+    if j == t.size:
+        return (n - const[-1]) / q[~capped].sum()
+    return (n - const[j - 1]) / slope[j - 1]
+
+
+def largest_remainder(quota, n, minimum=None, maximum=None):
+    """ Round sample quotas to integers summing to `n` (Hamilton method)
+
+    Quotas are first rescaled so that, after clipping each to its `minimum`
+    and `maximum`, they sum to `n`. Each class then receives the integer part
+    of its quota, and the samples left over go to the classes with the
+    largest fractional parts, with ties going to the earlier class. The
+    result is deterministic and needs O(K log K) array operations for K
+    classes.
+
+    Args:
+      quota (ndarray):          fractional number of samples, or relative
+                                share of samples, for each class
+      n (int):                  number of samples
+      minimum (int or ndarray, optional): minimum number of samples for all
+                                classes or for each class
+      maximum (int or ndarray, optional): maximum number of samples for all
+                                classes or for each class (e.g., the number
+                                of pixels in each class)
+
+    Returns:
+      counts (ndarray):         number of samples for each class
+
+    """
+    quota = np.asarray(quota, dtype=np.float64)
+    k = quota.size
+    if np.any(quota < 0):
+        raise ValueError('Sample quotas cannot be negative')
+
+    # Minimums cannot exceed maximums (e.g., for classes with few pixels)
+    upper = np.zeros(k) + (np.inf if maximum is None else maximum)
+    lower = np.minimum(np.zeros(k) + (0 if minimum is None else minimum),
+                       upper)
+    if lower.sum() > n:
+        raise ValueError('Minimum number of samples ({m}) is more than the '
+                         'sample size ({n})'.format(m=int(lower.sum()), n=n))
+    if upper.sum() < n:
+        raise ValueError('Sample size ({n}) is more than the maximum number '
+                         'of samples ({m})'.format(n=n, m=int(upper.sum())))
+
+    x = np.clip(_quota_scale(quota, n, lower, upper) * quota, lower, upper)
+
+    counts = np.floor(x).astype(np.int64)
+    remainder = int(n - counts.sum())
+    if remainder > 0:
+        fraction = x - counts
+        fraction[counts >= upper] = -1
+        order = np.argsort(-fraction, kind='mergesort')
+        counts[order[:remainder]] += 1
+
+    return counts
+
+
+def proportional(n, weights, maximum=None):
+    """ Allocate samples proportional to the area of each class
+
+    Args:
+      n (int):                  number of samples
+      weights (ndarray):        proportion of map area in each class
+      maximum (ndarray, optional): maximum number of samples for each class
+
+    Returns:
+      counts (ndarray):         number of samples for each class
+
+    """
+    return largest_remainder(_as_weights(weights), n, maximum=maximum)
+
+
+def equal(n, weights, maximum=None):
+    """ Allocate samples equally to each class
+
+    Args:
+      n (int):                  number of samples
+      weights (ndarray):        proportion of map area in each class, used
+                                only for the number of classes
+      maximum (ndarray, optional): maximum number of samples for each class
+
+    Returns:
+      counts (ndarray):         number of samples for each class
+
+    """
+    return largest_remainder(np.ones(np.size(weights)), n, maximum=maximum)
+
+
+def good_practices(n, weights, minimum=GOOD_PRACTICES_MINIMUM, maximum=None):
+    """ Allocate samples proportional to area with a minimum for each class
+
+    Classes whose proportional allocation would fall below `minimum` are
+    given `minimum` samples, and the remaining samples are allocated
+    proportionally among the other classes. If there are too few samples to
+    give every class the minimum, samples are allocated equally.
+
+    Args:
+      n (int):                  number of samples
+      weights (ndarray):        proportion of map area in each class
+      minimum (int, optional):  minimum number of samples for each class
+      maximum (ndarray, optional): maximum number of samples for each class
+
+    Returns:
+      counts (ndarray):         number of samples for each class
+
+    """
+    w = _as_weights(weights)
+    if n < w.size * minimum:
+        logger.warning('Too few samples to allocate {m} to each class - '
+                       'allocating equally'.format(m=minimum))
+        return equal(n, w, maximum=maximum)
+
+    return largest_remainder(w, n, minimum=minimum, maximum=maximum)
+
+
+def neyman(n, weights, users_accuracy, maximum=None):
+    """ Allocate samples to minimize variance of overall accuracy
+
+    Neyman (optimal) allocation gives each class samples in proportion to its
+    area times its standard deviation, estimated from expected user's
+    accuracy. Samples are allocated proportional to area if every class is
+    expected to be perfectly accurate.
+
+    Args:
+      n (int):                  number of samples
+      weights (ndarray):        proportion of map area in each class
+      users_accuracy (float or ndarray): expected user's accuracy of all
+                                classes, or of each class
+      maximum (ndarray, optional): maximum number of samples for each class
+
+    Returns:
+      counts (ndarray):         number of samples for each class
+
+    """
+    w = _as_weights(weights)
+    users = _users_accuracy(users_accuracy, w.size)
+    ws = w * np.sqrt(users * (1 - users))
+    if ws.sum() == 0:
+        return proportional(n, w, maximum=maximum)
+    return largest_remainder(ws, n, maximum=maximum)
+
+
+def sample_size(weights, users_accuracy, target_se, stratified=True):
+    """ Estimate sample size needed for a target standard error of overall
+    accuracy
+
+    For stratified samples this is Equation 13 of Olofsson et al. (2014),
+    which assumes the number of pixels in the map is large. For simple random
+    samples, overall accuracy is treated as a single binomial proportion.
+
+    Args:
+      weights (ndarray):        proportion of map area in each class
+      users_accuracy (float or ndarray): expected user's accuracy of all
+                                classes, or of each class
+      target_se (float):        target standard error of overall accuracy
+      stratified (bool, optional): estimate for a stratified random sample,
+                                or otherwise for a simple random sample
+
+    Returns:
+      n (int):                  number of samples
+
+    """
+    if target_se <= 0:
+        raise ValueError('Target standard error must be positive')
+    w = _as_weights(weights)
+    users = _users_accuracy(users_accuracy, w.size)
+
+    if stratified:
+        n = (np.sum(w * np.sqrt(users * (1 - users))) / target_se) ** 2
+    else:
+        overall = np.sum(w * users)
+        n = overall * (1 - overall) / target_se ** 2
+
+    return int(np.ceil(n))
+
+
+def allocate(method, n, weights, users_accuracy=None,
+             minimum=GOOD_PRACTICES_MINIMUM, maximum=None):
+    """ Allocate samples to classes using a named method
+
+    Args:
+      method (str):             one of `ALLOCATION_METHODS`
+      n (int):                  number of samples
+      weights (ndarray):        proportion of map area, or pixel count, of
+                                each class
+      users_accuracy (float or ndarray, optional): expected user's accuracy
+                                of all classes, or of each class, for
+                                "neyman" allocation
+      minimum (int, optional):  minimum number of samples for each class for
+                                "good_practices" allocation
+      maximum (ndarray, optional): maximum number of samples for each class
+                                (e.g., the number of pixels in each class)
+
+    Returns:
+      counts (ndarray):         number of samples for each class
+
+    """
+    if method == 'proportional':
+        return proportional(n, weights, maximum=maximum)
+    elif method == 'equal':
+        return equal(n, weights, maximum=maximum)
+    elif method == 'good_practices':
+        return good_practices(n, weights, minimum=minimum, maximum=maximum)
+    elif method == 'neyman':
+        if users_accuracy is None:
+            raise ValueError('Neyman allocation requires expected user\'s '
+                             'accuracy')
+        return neyman(n, weights, users_accuracy, maximum=maximum)
+    else:
+        raise ValueError('Unknown allocation method {m}'.format(m=method))
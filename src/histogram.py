@@ -0,0 +1,568 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ AccuracySampler
+
+ Plugin for generating random samples from maps for accuracy assessment
+                             -------------------
+        begin                : 2014-07-30
+        copyright            : (C) 2014 by Chris Holden
+        email                : ceholden@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Class histograms of classification maps held in memory or read from GDAL
+ raster bands one block at a time.
+"""
+from __future__ import division
+
+import functools
+import hashlib
+import logging
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import os
+import tempfile
+import threading
+
+import numpy as np
+try:
+    from osgeo import gdal
+except:
+    import gdal
+
+from rawraster import MemmapBand
+
+logger = logging.getLogger(__name__)
+
+# Range of integer values always histogrammed with np.bincount, which is
+#   otherwise used only for ranges up to `_BINCOUNT_PER_PIXEL` per pixel
+_BINCOUNT_MIN_RANGE = 2 ** 16
+_BINCOUNT_PER_PIXEL = 4
+
+# Number of block histograms to merge at once
+_MERGE_CHUNK = 256
+
+# GDAL datasets opened by each worker thread
+_thread_local = threading.local()
+
+# Directory and maximum number of entries for cached histograms
+CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME',
+                   os.path.join(os.path.expanduser('~'), '.cache')),
+    'accuracy_sampler')
+CACHE_SIZE = 256
+
+# NumPy types of GDAL integer data types
+_GDAL_INTEGER_TYPES = {
+    'Byte': np.uint8,
+    'Int8': np.int8,
+    'UInt16': np.uint16,
+    'Int16': np.int16,
+    'UInt32': np.uint32,
+    'Int32': np.int32,
+    'UInt64': np.uint64,
+    'Int64': np.int64
+}
+
+
+def block_windows(band, tile_size=None):
+    """ Yield the natural GDAL block windows of a raster band
+
+    Args:
+      band (gdal.Band):         raster band
+      tile_size (int, optional):    combine neighboring blocks into windows
+                                    at least this many pixels on each side
+
+    Yields:
+      window (tuple):           offsets and sizes of a block window as
+                                (xoff, yoff, xsize, ysize)
+
+    """
+    block_xsize, block_ysize = band.GetBlockSize()
+    if tile_size:
+        block_xsize *= max(1, -(-tile_size // block_xsize))
+        block_ysize *= max(1, -(-tile_size // block_ysize))
+
+    for yoff in range(0, band.YSize, block_ysize):
+        ysize = min(block_ysize, band.YSize - yoff)
+        for xoff in range(0, band.XSize, block_xsize):
+            xsize = min(block_xsize, band.XSize - xoff)
+            yield (xoff, yoff, xsize, ysize)
+
+
+def class_histogram(class_map):
+    """ Return the classes and pixel count of each class within a map
+
+    Integer maps whose values span a range that is small compared with the
+    number of pixels are counted with ``np.bincount`` over that range, and
+    all other maps with ``np.unique``.
+
+    Args:
+      class_map (ndarray):      classification map
+
+    Returns:
+      classes, counts (tuple):  ndarray of the classes and of the pixel count
+                                of each class
+
+    """
+    values = np.asarray(class_map).ravel()
+    if values.size == 0:
+        return (values, np.zeros(0, dtype=np.int64))
+
+    dtype = values.dtype
+    if dtype.kind in 'iu' and dtype.itemsize < 8:
+        vmin, vmax = int(values.min()), int(values.max())
+        if vmax - vmin <= max(_BINCOUNT_MIN_RANGE,
+                              _BINCOUNT_PER_PIXEL * values.size):
+            # Count from the smallest value so bins span only the range used
+            if vmin != 0:
+                values = values.astype(np.int64) - vmin
+            counts = np.bincount(values)
+            classes = np.flatnonzero(counts)
+            return ((classes + vmin).astype(dtype),
+                    counts[classes].astype(np.int64))
+
+    classes, counts = np.unique(values, return_counts=True)
+    return (classes, counts.astype(np.int64))
+
+
+def class_lookup(classes, dtype, index=False):
+    """ Return a lookup table of `classes` over every value of an 8 or 16 bit
+    integer data type
+
+    Values of a map are looked up with `lookup_values`, so testing every
+    pixel of a block against the classes is a single gather instead of a
+    sort-based membership test.
+
+    Args:
+      classes (ndarray):        classes in the table
+      dtype (np.dtype):         data type of values to be looked up
+      index (bool, optional):   store position of each value in `classes`,
+                                or -1 for other values, instead of whether
+                                each value is one of `classes`
+
+    Returns:
+      lookup (ndarray):         boolean or index lookup table, or None if
+                                `dtype` is not an 8 or 16 bit integer type
+
+    """
+    dtype = np.dtype(dtype)
+    if dtype.kind not in 'iu' or dtype.itemsize > 2:
+        return None
+
+    classes = np.atleast_1d(np.asarray(classes if classes is not None
+                                       else []))
+    position = np.arange(classes.size)
+    if classes.size:
+        info = np.iinfo(dtype)
+        keep = (classes >= info.min) & (classes <= info.max) & \
+            (classes == np.round(classes))
+        classes, position = classes[keep], position[keep]
+
+    # Signed values are looked up by their unsigned bit pattern
+    native = dtype.newbyteorder('=')
+    unsigned = np.dtype('u{n}'.format(n=dtype.itemsize))
+    slots = classes.astype(native).view(unsigned)
+
+    if index:
+        lookup = np.full(2 ** (8 * dtype.itemsize), -1, dtype=np.intp)
+        lookup[slots] = position
+    else:
+        lookup = np.zeros(2 ** (8 * dtype.itemsize), dtype=bool)
+        lookup[slots] = True
+
+    return lookup
+
+
+def lookup_values(lookup, values):
+    """ Return entries of a lookup table from `class_lookup` for `values`
+
+    Args:
+      lookup (ndarray):         lookup table built for the type of `values`
+      values (ndarray):         8 or 16 bit integer values
+
+    Returns:
+      ndarray:                  lookup table entry of each value
+
+    """
+    if values.dtype.kind == 'i':
+        values = values.view(values.dtype.str.replace('i', 'u'))
+    return lookup[values]
+
+
+def in_classes(values, classes, lookup=None):
+    """ Return mask of `values` that are one of `classes`
+
+    8 and 16 bit integer values are tested with a boolean lookup table, and
+    other values with ``np.isin``. Pass a `lookup` from `class_lookup` to
+    reuse the table across blocks of the same map.
+
+    Args:
+      values (ndarray):         values to test, such as a block of a map
+      classes (ndarray):        classes to test for, or None for no classes
+      lookup (ndarray, optional):   boolean lookup table of `classes` for the
+                                    type of `values`
+
+    Returns:
+      mask (ndarray):           boolean mask with the shape of `values`
+
+    """
+    values = np.asarray(values)
+    if lookup is None:
+        lookup = class_lookup(classes, values.dtype)
+    if lookup is not None:
+        return lookup_values(lookup, values)
+    if classes is None:
+        return np.zeros(values.shape, dtype=bool)
+    return np.isin(values, classes)
+
+
+def merge_histograms(histograms):
+    """ Merge class histograms, adding together counts of the same class
+
+    Args:
+      histograms (iterable):    (classes, counts) tuples of ndarrays
+
+    Returns:
+      classes, counts (tuple):  ndarray of the classes and of the pixel count
+                                of each class
+
+    """
+    histograms = list(histograms)
+    if not histograms:
+        return (np.zeros(0), np.zeros(0, dtype=np.int64))
+
+    classes = np.concatenate([h[0] for h in histograms])
+    counts = np.concatenate([h[1] for h in histograms])
+
+    classes, inverse = np.unique(classes, return_inverse=True)
+    counts = np.bincount(inverse.ravel(), weights=counts,
+                         minlength=classes.size)
+
+    return (classes, np.round(counts).astype(np.int64))
+
+
+def _thread_band(filename, bidx):
+    """ Return raster band opened by and for use only in the current thread
+    """
+    datasets = getattr(_thread_local, 'datasets', None)
+    if datasets is None:
+        datasets = _thread_local.datasets = {}
+    if filename not in datasets:
+        datasets[filename] = gdal.Open(filename, gdal.GA_ReadOnly)
+    return datasets[filename].GetRasterBand(bidx)
+
+
+def _window_histogram(job):
+    """ Return class histogram of one window of a raster band """
+    filename, bidx, (xoff, yoff, xsize, ysize) = job
+    band = _thread_band(filename, bidx)
+    return class_histogram(band.ReadAsArray(xoff, yoff, xsize, ysize))
+
+
+def _view_histogram(band, window):
+    """ Return class histogram of one window of a memory-mapped band """
+    return class_histogram(band.ReadAsArray(*window))
+
+
+def _cache_filename(band, cache_dir=None):
+    """ Return filename of cached histogram for a raster band, or None if the
+    band is not backed by a file
+    """
+    ds = band.GetDataset()
+    filename = ds.GetDescription() if ds is not None else ''
+    if not filename or not os.path.isfile(filename):
+        return None
+
+    # Include every file of the dataset, such as the sources of a VRT, but
+    #   not auxiliary metadata that GDAL may rewrite
+    key = ['{f}\n{b}'.format(f=os.path.abspath(filename), b=band.GetBand())]
+    for fn in sorted(set([filename] + list(ds.GetFileList() or []))):
+        if fn.lower().endswith('.aux.xml') or not os.path.isfile(fn):
+            continue
+        stat = os.stat(fn)
+        key.append('{f}\n{s}\n{m!r}'.format(f=os.path.abspath(fn),
+                                            s=stat.st_size,
+                                            m=stat.st_mtime))
+    key = '\n'.join(key)
+    return os.path.join(cache_dir or CACHE_DIR,
+                        hashlib.sha1(key.encode('utf-8')).hexdigest() +
+                        '.npz')
+
+
+def read_histogram_cache(band, cache_dir=None):
+    """ Return cached class histogram for a raster band
+
+    Cached histograms are keyed by the path and band number of the raster,
+    and the size and modification time of each of its files.
+
+    Args:
+      band (gdal.Band):         raster band of classification map
+      cache_dir (str, optional):    cache directory (default: `CACHE_DIR`)
+
+    Returns:
+      classes, counts (tuple):  ndarray of the classes and of the pixel count
+                                of each class, or None if band is not cached
+
+    """
+    cache_file = _cache_filename(band, cache_dir)
+    if cache_file is None or not os.path.isfile(cache_file):
+        return None
+
+    try:
+        with np.load(cache_file) as cached:
+            hist = (cached['classes'], cached['counts'])
+        # Mark as recently used
+        os.utime(cache_file, None)
+    except Exception as e:
+        logger.warning('Could not read cached histogram {f}: {e}'.format(
+            f=cache_file, e=e))
+        return None
+
+    logger.debug('Read cached histogram {f}'.format(f=cache_file))
+    return hist
+
+
+def write_histogram_cache(band, hist, cache_dir=None):
+    """ Cache class histogram for a raster band
+
+    The least recently used entries are removed once the cache holds more
+    than `CACHE_SIZE` histograms.
+
+    Args:
+      band (gdal.Band):         raster band of classification map
+      hist (tuple):             ndarray of the classes and of the pixel count
+                                of each class
+      cache_dir (str, optional):    cache directory (default: `CACHE_DIR`)
+
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    cache_file = _cache_filename(band, cache_dir)
+    if cache_file is None:
+        return
+
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+        # Write to temporary file first so readers never see partial entries
+        fd, tmp = tempfile.mkstemp(suffix='.npz', dir=cache_dir)
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, classes=hist[0], counts=hist[1])
+        os.rename(tmp, cache_file)
+
+        entries = [os.path.join(cache_dir, f) for f in os.listdir(cache_dir)
+                   if f.endswith('.npz')]
+        entries.sort(key=os.path.getmtime)
+        for entry in entries[:max(len(entries) - CACHE_SIZE, 0)]:
+            os.remove(entry)
+    except (IOError, OSError) as e:
+        logger.warning('Could not cache histogram: {e}'.format(e=e))
+        return
+
+    logger.debug('Cached histogram to {f}'.format(f=cache_file))
+
+
+def _integer_dtype(band):
+    """ Return NumPy type of an integer band data type, or None """
+    return _GDAL_INTEGER_TYPES.get(gdal.GetDataTypeName(band.DataType))
+
+
+def _exact_histogram(band, values, counts):
+    """ Return histogram if it counts every pixel within an integer band
+    """
+    dtype = _integer_dtype(band)
+    if dtype is None:
+        return None
+
+    info = np.iinfo(dtype)
+    values, counts = np.asarray(values), np.asarray(counts, dtype=np.float64)
+    if (values.size == 0 or
+            np.any(values < info.min) or np.any(values > info.max) or
+            np.any(counts != np.round(counts)) or
+            counts.sum() != band.XSize * band.YSize):
+        return None
+
+    keep = counts > 0
+    return merge_histograms([(values[keep].astype(dtype),
+                              counts[keep].astype(np.int64))])
+
+
+def _rat_histogram(band):
+    """ Return histogram from pixel counts in band's raster attribute table
+    """
+    rat = band.GetDefaultRAT()
+    if rat is None:
+        return None
+
+    count_col = rat.GetColOfUsage(gdal.GFU_PixelCount)
+    if count_col < 0:
+        return None
+
+    n_rows = rat.GetRowCount()
+    counts = [rat.GetValueAsDouble(i, count_col) for i in range(n_rows)]
+
+    value_col = rat.GetColOfUsage(gdal.GFU_MinMax)
+    if value_col >= 0:
+        values = [rat.GetValueAsInt(i, value_col) for i in range(n_rows)]
+    else:
+        # Rows might instead be bins of equal width over the values
+        linear, row0_min, bin_size = rat.GetLinearBinning()
+        if not linear or bin_size != 1:
+            return None
+        values = np.ceil(row0_min) + np.arange(n_rows)
+
+    return _exact_histogram(band, values, counts)
+
+
+def _default_histogram(band):
+    """ Return histogram from band's default histogram, if stored
+    """
+    try:
+        stored = band.GetDefaultHistogram(force=False)
+    except RuntimeError:
+        return None
+    if not stored:
+        return None
+
+    vmin, vmax, n_buckets, counts = stored
+    # Histogram must have one bucket per integer value, allowing the slightly
+    #   narrower buckets written by older GDAL (e.g., -0.498 to 255.498)
+    if n_buckets == 0 or n_buckets != np.round(vmax - vmin):
+        return None
+    edges = vmin + (vmax - vmin) * np.arange(n_buckets + 1) / n_buckets
+    values = np.ceil(edges)
+    if np.any(np.diff(values) != 1):
+        return None
+    # Value of each bucket is the integer it contains
+    values = values[:-1]
+
+    return _exact_histogram(band, values, counts)
+
+
+def stored_histogram(band):
+    """ Return class histogram stored with a raster band
+
+    Pixel counts from a raster attribute table, or a default histogram with
+    one bucket per value (e.g., from a ".aux.xml" file), are used if the band
+    has an integer data type and the histogram counts every pixel in the band.
+
+    Args:
+      band (gdal.Band):         raster band of classification map
+
+    Returns:
+      classes, counts (tuple):  ndarray of the classes and of the pixel count
+                                of each class, or None if band has no exact
+                                stored histogram
+
+    """
+    for source in (_rat_histogram, _default_histogram):
+        hist = source(band)
+        if hist is not None:
+            logger.debug('Using histogram stored with raster band')
+            return hist
+    return None
+
+
+def lookup_histogram(band, cache=True):
+    """ Return class histogram of a raster band without reading the band
+
+    Args:
+      band (gdal.Band):         raster band of classification map
+      cache (bool, optional):   read cached histogram
+
+    Returns:
+      classes, counts (tuple):  ndarray of the classes and of the pixel count
+                                of each class, or None if a histogram is not
+                                stored with the band or cached
+
+    """
+    hist = stored_histogram(band)
+    if hist is None and cache:
+        hist = read_histogram_cache(band)
+    return hist
+
+
+def raster_histogram(band, n_threads=None, cache=True):
+    """ Return the classes and pixel count of each class within a raster band
+
+    The band is read and counted one block at a time. Blocks are divided
+    among a pool of threads that each open their own handle to the dataset,
+    unless the band is not backed by a file (e.g., a "MEM" dataset) or
+    `n_threads` is 1. Threads read windows of memory-mapped bands (see
+    `rawraster.MemmapBand`) directly. Histograms of bands backed by a file
+    are cached (see
+    `read_histogram_cache`), including the count of any NoData values. The
+    band is not read if it has a stored histogram (see `stored_histogram`).
+
+    Args:
+      band (gdal.Band):         raster band of classification map
+      n_threads (int, optional):    number of threads (default: number of
+                                    CPUs)
+      cache (bool, optional):   read and write cached histogram
+
+    Returns:
+      classes, counts (tuple):  ndarray of the classes and of the pixel count
+                                of each class
+
+    """
+    hist = lookup_histogram(band, cache=cache)
+    if hist is not None:
+        return hist
+
+    if n_threads is None:
+        n_threads = multiprocessing.cpu_count()
+
+    ds = band.GetDataset()
+    filename = ds.GetDescription() if ds is not None else ''
+    driver = ds.GetDriver().ShortName if ds is not None else 'MEM'
+
+    if n_threads <= 1 or not filename or driver == 'MEM':
+        logger.debug('Calculating histogram one block at a time')
+        partials = (class_histogram(band.ReadAsArray(*window))
+                    for window in block_windows(band))
+        hist = _reduce_histograms(partials)
+        if cache:
+            write_histogram_cache(band, hist)
+        return hist
+
+    logger.debug('Calculating histogram one block at a time using {n} '
+                 'threads'.format(n=n_threads))
+    if isinstance(band, MemmapBand):
+        func = functools.partial(_view_histogram, band)
+        jobs = block_windows(band)
+    else:
+        func = _window_histogram
+        jobs = ((filename, band.GetBand(), window)
+                for window in block_windows(band))
+
+    pool = ThreadPool(n_threads)
+    try:
+        partials = pool.imap_unordered(func, jobs, chunksize=16)
+        hist = _reduce_histograms(partials)
+    finally:
+        pool.close()
+        pool.join()
+
+    if cache:
+        write_histogram_cache(band, hist)
+
+    return hist
+
+
+def _reduce_histograms(partials):
+    """ Merge an iterable of histograms a chunk at a time """
+    hist = []
+    for partial in partials:
+        hist.append(partial)
+        if len(hist) >= _MERGE_CHUNK:
+            hist = [merge_histograms(hist)]
+    return merge_histograms(hist)
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ AccuracySampler
+
+ Plugin for generating random samples from maps for accuracy assessment
+                             -------------------
+        begin                : 2014-07-30
+        copyright            : (C) 2014 by Chris Holden
+        email                : ceholden@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Memory-mapped access to raster bands stored without compression.
+
+ Bands of ENVI and ESRI BIL/BSQ/BIP ("EHdr") rasters, and of uncompressed
+ striped GeoTIFFs whose strips are stored contiguously, are exposed as
+ read-only ``np.memmap`` arrays so that reading a window of the map is a
+ view of the file rather than a copy. The operating system pages the file in
+ and out as needed, so maps larger than memory can be read.
+"""
+from __future__ import division
+
+import logging
+import os
+import re
+
+import numpy as np
+try:
+    from osgeo import gdal_array
+except:
+    import gdal_array
+
+logger = logging.getLogger(__name__)
+
+# Approximate number of pixels in each window of a memory-mapped band
+_WINDOW_PIXELS = 2 ** 20
+
+
+def _envi_header(filename):
+    """ Return dict of lower case keys and values from an ENVI header """
+    with open(filename) as f:
+        text = f.read()
+    # Join values spanning multiple lines within braces
+    text = re.sub(r'\{[^}]*\}', lambda m: ' '.join(m.group(0).split()), text)
+
+    header = {}
+    for line in text.splitlines():
+        if '=' in line:
+            key, value = line.split('=', 1)
+            header[key.strip().lower()] = value.strip()
+    return header
+
+
+def _header_file(ds, extensions):
+    """ Return filename of header of dataset with one of `extensions` """
+    for filename in ds.GetFileList() or []:
+        if os.path.splitext(filename)[1].lower() in extensions:
+            return filename
+    return None
+
+
+def _envi_layout(ds, band, dtype):
+    """ Return layout of band in an ENVI raster file """
+    header = _header_file(ds, ('.hdr', ))
+    if header is None:
+        return None
+    header = _envi_header(header)
+    if header.get('file compression', '0') != '0':
+        return None
+
+    return {
+        'filename': ds.GetFileList()[0],
+        'offset': int(header.get('header offset', 0)),
+        'byteorder': '>' if header.get('byte order', '0') == '1' else '<',
+        'interleave': header.get('interleave', 'bsq').lower(),
+        'n_bands': ds.RasterCount,
+        'band': band.GetBand() - 1
+    }
+
+
+def _ehdr_layout(ds, band, dtype):
+    """ Return layout of band in an ESRI BIL/BSQ/BIP raster file """
+    header = _header_file(ds, ('.hdr', ))
+    if header is None:
+        return None
+    with open(header) as f:
+        header = dict(line.upper().split()[:2] for line in f
+                      if len(line.split()) > 1)
+    interleave = header.get('LAYOUT', 'BIL').lower()
+
+    # Padded rows cannot be mapped as a simple array
+    row_bytes = ds.RasterXSize * dtype.itemsize
+    if interleave != 'bip' and \
+            int(header.get('BANDROWBYTES', row_bytes)) != row_bytes:
+        return None
+    if interleave == 'bil' and int(header.get(
+            'TOTALROWBYTES', row_bytes * ds.RasterCount)) != \
+            row_bytes * ds.RasterCount:
+        return None
+
+    return {
+        'filename': ds.GetFileList()[0],
+        'offset': int(header.get('SKIPBYTES', 0)),
+        'byteorder': '>' if header.get('BYTEORDER', 'I') in
+        ('M', 'MSBFIRST') else '<',
+        'interleave': interleave,
+        'n_bands': ds.RasterCount,
+        'band': band.GetBand() - 1
+    }
+
+
+def _gtiff_layout(ds, band, dtype):
+    """ Return layout of band in an uncompressed, striped GeoTIFF whose
+    strips are stored one after another
+    """
+    if ds.GetMetadataItem('COMPRESSION', 'IMAGE_STRUCTURE') or \
+            band.GetMetadataItem('NBITS', 'IMAGE_STRUCTURE'):
+        return None
+    if ds.RasterCount > 1 and \
+            ds.GetMetadataItem('INTERLEAVE', 'IMAGE_STRUCTURE') != 'BAND':
+        return None
+
+    block_xsize, block_ysize = band.GetBlockSize()
+    if block_xsize != ds.RasterXSize:
+        return None
+
+    # Strips must be contiguous, without sparse or reordered strips
+    strip_bytes = block_xsize * block_ysize * dtype.itemsize
+    n_strips = -(-ds.RasterYSize // block_ysize)
+    offsets = np.array([int(band.GetMetadataItem(
+        'BLOCK_OFFSET_0_{i}'.format(i=i), 'TIFF') or 0)
+        for i in range(n_strips)], dtype=np.int64)
+    if offsets[0] <= 0 or np.any(offsets != offsets[0] +
+                                 np.arange(n_strips) * strip_bytes):
+        return None
+
+    filename = ds.GetDescription()
+    with open(filename, 'rb') as f:
+        byteorder = {b'II': '<', b'MM': '>'}.get(f.read(2))
+    if byteorder is None:
+        return None
+
+    return {
+        'filename': filename,
+        'offset': int(offsets[0]),
+        'byteorder': byteorder,
+        'interleave': 'bsq',
+        'n_bands': 1,
+        'band': 0
+    }
+
+
+_LAYOUTS = {
+    'ENVI': _envi_layout,
+    'EHdr': _ehdr_layout,
+    'GTiff': _gtiff_layout
+}
+
+
+def band_memmap(band):
+    """ Return a raster band as a read-only memory-mapped array
+
+    Args:
+      band (gdal.Band):         raster band
+
+    Returns:
+      np.memmap:                array of the band with a row for each line,
+                                or None if the band's layout on disk cannot
+                                be memory-mapped
+
+    """
+    ds = band.GetDataset()
+    if ds is None or ds.GetDriver().ShortName not in _LAYOUTS:
+        return None
+    typecode = gdal_array.GDALTypeCodeToNumericTypeCode(band.DataType)
+    if typecode is None:
+        return None
+    dtype = np.dtype(typecode)
+
+    try:
+        layout = _LAYOUTS[ds.GetDriver().ShortName](ds, band, dtype)
+        if layout is None or layout['interleave'] not in ('bsq', 'bil', 'bip'):
+            return None
+
+        dtype = dtype.newbyteorder(layout['byteorder'])
+        nrow, ncol, n_bands = band.YSize, band.XSize, layout['n_bands']
+        size = layout['offset'] + nrow * ncol * n_bands * dtype.itemsize
+        if os.path.getsize(layout['filename']) < size:
+            return None
+
+        b = layout['band']
+        if layout['interleave'] == 'bsq':
+            return np.memmap(layout['filename'], dtype=dtype, mode='r',
+                             offset=layout['offset'] +
+                             b * nrow * ncol * dtype.itemsize,
+                             shape=(nrow, ncol))
+        elif layout['interleave'] == 'bil':
+            return np.memmap(layout['filename'], dtype=dtype, mode='r',
+                             offset=layout['offset'],
+                             shape=(nrow, n_bands, ncol))[:, b, :]
+        else:
+            return np.memmap(layout['filename'], dtype=dtype, mode='r',
+                             offset=layout['offset'],
+                             shape=(nrow, ncol, n_bands))[:, :, b]
+    except (IOError, OSError, ValueError) as e:
+        logger.debug('Cannot memory-map band: {e}'.format(e=e))
+        return None
+
+
+class MemmapBand(object):
+    """ Raster band read from a memory-mapped array
+
+    Windows read with `ReadAsArray` are read-only views of the file instead
+    of copies. All other attributes are those of the GDAL raster band.
+
+    Args:
+      band (gdal.Band):         raster band
+      array (np.memmap):        memory-mapped array of `band`
+
+    """
+    def __init__(self, band, array):
+        self.band = band
+        self.array = array
+        self.XSize = band.XSize
+        self.YSize = band.YSize
+
+    def __getattr__(self, name):
+        return getattr(self.band, name)
+
+    def GetBlockSize(self):
+        """ Return window of whole rows holding about `_WINDOW_PIXELS` """
+        return [self.XSize,
+                max(1, min(self.YSize, _WINDOW_PIXELS // self.XSize))]
+
+    def ReadAsArray(self, xoff=0, yoff=0, win_xsize=None, win_ysize=None):
+        """ Return view of a window of the band """
+        if win_xsize is None:
+            win_xsize = self.XSize - xoff
+        if win_ysize is None:
+            win_ysize = self.YSize - yoff
+        return self.array[yoff:yoff + win_ysize, xoff:xoff + win_xsize]
+
+
+def mapped_band(band):
+    """ Return raster band backed by a memory-mapped array if possible
+
+    Args:
+      band (gdal.Band):         raster band
+
+    Returns:
+      MemmapBand or gdal.Band:  memory-mapped band, or `band` if its layout on
+                                disk cannot be memory-mapped
+
+    """
+    if isinstance(band, MemmapBand):
+        return band
+    array = band_memmap(band)
+    if array is None:
+        return band
+    logger.debug('Memory-mapped band {b}'.format(b=band.GetBand()))
+    return MemmapBand(band, array)
@@ -26,6 +26,11 @@ import logging
 
 import numpy as np
 
+from allocation import (GOOD_PRACTICES_MINIMUM, good_practices,
+                        largest_remainder, neyman, sample_size)
+from histogram import class_histogram, in_classes, raster_histogram
+from samplers import sample
+
 logger = logging.getLogger(__name__)
 
 
@@ -60,7 +65,8 @@ class SampleDesign(object):
         """ Initializse with some number of samples in the design
 
         Args:
-          class_map (ndarray):      a NumPy 2D array of the classification map
+          class_map (ndarray or gdal.Band): a NumPy 2D array or GDAL raster
+                                    band of the classification map
           n_samples (int):          number of samples
           nodata (int, optional):   NoData value for the map
         """
@@ -81,48 +87,63 @@ class SampleDesign(object):
             - class proportion of total map
 
         """
-        # Get classes and total number of valid pixels
-        if isinstance(self.nodata, (list, np.ndarray)):
-            # Get values not matching anything in self.nodata
-            unmasked = self.class_map != self.nodata[0]
-            for nodata in self.nodata[1:]:
-                unmasked = np.logical_and(unmasked,
-                                          self.class_map != nodata)
-
-            self.classes = np.unique(self.class_map[unmasked])
-            n_valid_pixels = unmasked.sum()
-        elif isinstance(self.nodata, int):
-            self.classes = np.unique(
-                self.class_map[self.class_map != self.nodata])
-            n_valid_pixels = (self.class_map != self.nodata).sum()
+        # Get classes and their frequency in one pass over the map, or from
+        #   a histogram stored with the raster band
+        if isinstance(self.class_map, np.ndarray):
+            classes, class_freq = class_histogram(self.class_map)
         else:
-            self.classes = np.unique(self.class_map)
-            n_valid_pixels = self.class_map.size
+            classes, class_freq = raster_histogram(self.class_map)
+
+        # Exclude NoData values
+        if self.nodata is not None:
+            valid = ~in_classes(classes, self.nodata)
+            classes, class_freq = classes[valid], class_freq[valid]
+
+        self.classes = classes
+        self.class_freq = class_freq
 
         # Number of classes
         self.class_count = self.classes.size
 
-        # Get class frequency
-        self.class_freq = np.zeros(self.classes.size)
-        for i, c in enumerate(self.classes):
-            self.class_freq[i] = (self.class_map == c).sum()
-
         # Get class proportion
         self.class_proportion = (self.class_freq.astype(np.float32) /
-                                 n_valid_pixels)
+                                 self.class_freq.sum())
 
     @abc.abstractmethod
-    def sample_map(self, seed=None):
-        """ Perform a stratified random sample on the map
+    def sample_map(self, seed=None, order=False, engine=None):
+        """ Perform a probability sample on the map
 
         Args:
           seed (int, optional):     specify seed for RNG
+          order (bool, optional):   order samples by strata, or randomize
+          engine (str, optional):   sampling engine (see `samplers.sample`),
+                                    defaulting to "memory" for arrays and
+                                    "block" for raster bands
 
         Returns:
-          samples (ndarray):        Samples for each strata
+          samples (ndarray):        structured array with "stratum", "row"
+                                    and "col" of each sample
         """
         pass
 
+    def _sample(self, method, allocation=None, seed=None, order=False,
+                engine=None):
+        """ Sample the map using the map classes already counted """
+        if seed is not None:
+            self.seed = seed
+        if engine is None:
+            engine = 'memory' if isinstance(self.class_map, np.ndarray) \
+                else 'block'
+
+        return sample(self.class_map, method,
+                      size=self.n_samples,
+                      allocation=allocation,
+                      mask=self.nodata,
+                      order=order,
+                      engine=engine,
+                      histogram=(self.classes, self.class_freq),
+                      seed=self.seed)
+
     def allocate(self, n_samples, allocation=None):
         """ Allocate samples according to some strategy
 
@@ -138,23 +159,34 @@ class SimpleRandomDesign(SampleDesign):
     def __repr__(self):
         return "A simple random probability sample"
 
-    def __init__(self, n_samples):
-        """ Initialize a simple random with some number of samples """
-        super(self.__class__, self).__init__()
+    def __init__(self, class_map, n_samples, nodata=None):
+        """ Initialize a simple random with some number of samples
 
-        raise NotImplementedError
+        Args:
+          class_map (ndarray or gdal.Band): a NumPy 2D array or GDAL raster
+                                    band of the classification map
+          n_samples (int):          number of samples
+          nodata (int, optional):   NoData value for the map
+        """
+        super(SimpleRandomDesign, self).__init__(
+            class_map, n_samples, nodata)
 
-    def sample_map(self, n_samples, seed=None):
-        """ Perform a stratified random sample on the map
+    def sample_map(self, seed=None, order=False, engine=None):
+        """ Perform a simple random sample on the map
+
+        Strata of all samples are 1 because there are no strata in a simple
+        random sample.
 
         Args:
-          n_samples (int):          number of samples
           seed (int, optional):     specify seed for RNG
+          order (bool, optional):   order samples by strata, or randomize
+          engine (str, optional):   sampling engine (see `samplers.sample`)
 
         Returns:
-          samples (ndarray):        Samples for each strata
+          samples (ndarray):        structured array with "stratum", "row"
+                                    and "col" of each sample
         """
-        pass
+        return self._sample('random', seed=seed, order=order, engine=engine)
 
 
 class StratifiedRandomSample(SampleDesign):
@@ -165,10 +197,18 @@ class StratifiedRandomSample(SampleDesign):
     allocation = 0
     allocation_str = ['Proportional to area',
                       'Equal allocation',
-                      'User specified']
+                      'User specified',
+                      'Good practices',
+                      'Optimal (Neyman)']
     _allocation_prop = 0
     _allocation_equal = 1
     _allocation_user = 2
+    _allocation_good_practices = 3
+    _allocation_neyman = 4
+
+    # Allocation parameters
+    users_accuracy = None
+    minimum = GOOD_PRACTICES_MINIMUM
 
     def __repr__(self):
         s = "A stratified random probability sample of {n} samples for " \
@@ -180,21 +220,24 @@ class StratifiedRandomSample(SampleDesign):
         """ Initializse with some number of samples in the design
 
         Args:
-          class_map (ndarray):      a NumPy 2D array of the classification map
+          class_map (ndarray or gdal.Band): a NumPy 2D array or GDAL raster
+                                    band of the classification map
           n_samples (int):          number of samples
           nodata (int, optional):   NoData value for the map
         """
-        super(self.__class__, self).__init__(
+        super(StratifiedRandomSample, self).__init__(
             class_map, n_samples, nodata)
 
         # Allocate our samples initially
         self.allocate(self._allocation_prop)
 
-    def allocate(self, allocation):
+    def allocate(self, allocation, samples=None):
         """ Allocate number of samples to map categories based on type
 
         Args:
             allocation_type (int):  code corresponding to allocation_str
+            samples (ndarray, optional): number of samples for each class for
+                                    user specified allocation
 
         """
         if self.n_samples < self.class_count:
@@ -208,66 +251,103 @@ class StratifiedRandomSample(SampleDesign):
             logger.info('Allocating samples to all strata equally')
             self._allocate_equal()
         elif allocation == self._allocation_user:
-            logger.warning('No allocation method user specified allocation')
+            logger.info('Using user specified allocation')
+            self._allocate_user(samples)
+        elif allocation == self._allocation_good_practices:
+            logger.info('Allocating samples with minimum of {m} per '
+                        'stratum'.format(m=self.minimum))
+            self.samples = good_practices(self.n_samples,
+                                          self.class_proportion,
+                                          minimum=self.minimum,
+                                          maximum=self.class_freq)
+        elif allocation == self._allocation_neyman:
+            logger.info('Allocating samples to minimize variance of overall '
+                        'accuracy')
+            if self.users_accuracy is None:
+                raise ValueError('Must set expected user\'s accuracy for '
+                                 'optimal allocation')
+            self.samples = neyman(self.n_samples, self.class_proportion,
+                                  self.users_accuracy,
+                                  maximum=self.class_freq)
+        else:
+            raise ValueError('Unknown allocation type {a}'.format(
+                a=allocation))
 
-    def _allocate_prop(self):
-        """ Allocation samples proportional to area
+        self.allocation = allocation
+
+    def estimate_sample_size(self, users_accuracy, target_se):
+        """ Set number of samples needed for a target standard error of
+        overall accuracy
 
-        Number of samples allocated will be rounded up or down, with any
-        remainder allocated to last class.
+        Args:
+            users_accuracy (float or ndarray): expected user's accuracy of
+                                    all classes, or of each class
+            target_se (float):      target standard error of overall accuracy
+
+        Returns:
+            n_samples (int):        number of samples
 
         """
-        self.samples = np.zeros(self.class_count, dtype=np.uint32)
+        self.users_accuracy = users_accuracy
+        self.n_samples = sample_size(self.class_proportion, users_accuracy,
+                                     target_se)
+        return self.n_samples
 
-        # Keep counter to make sure we have samples left to allocate
-        remaining = self.n_samples
+    def _allocate_user(self, samples):
+        """ Allocate samples as specified by the user
 
-        for i, prop in enumerate(self.class_proportion):
-            n = round(self.n_samples * prop)
+        Args:
+            samples (ndarray):      number of samples for each class
 
-            if n > remaining:
-                n = remaining
+        """
+        if samples is None:
+            raise ValueError('Must specify number of samples for each class')
+        samples = np.asarray(samples, dtype=np.int64)
+        if samples.shape != (self.class_count, ):
+            raise ValueError('Number of samples must be specified for each '
+                             'of {n} classes'.format(n=self.class_count))
+        if np.any(samples < 0):
+            raise ValueError('Number of samples cannot be negative')
+
+        self.samples = samples
+        self.n_samples = int(samples.sum())
 
-            remaining -= n
+    def _allocate_prop(self):
+        """ Allocation samples proportional to area
 
-            self.samples[i] = n
+        Fractional allocations are rounded by the largest remainder method,
+        and no class is allocated more samples than it has pixels.
 
-        assert self.samples.sum() == self.n_samples, \
-            "Error in proportional allocation"
+        """
+        self.samples = largest_remainder(self.class_proportion,
+                                         self.n_samples,
+                                         maximum=self.class_freq)
 
     def _allocate_equal(self):
         """ Allocate samples equally across all strata
 
         If number of samples is not evenly divisible by the number of classes,
-        then extra samples are allocated to the first classes.
+        then extra samples are allocated to the first classes. No class is
+        allocated more samples than it has pixels.
 
         """
-        # How many samples per class?
-        n_per = int(self.n_samples / self.class_count)
+        self.samples = largest_remainder(np.ones(self.class_count),
+                                         self.n_samples,
+                                         maximum=self.class_freq)
 
-        # Allocate base amount
-        self.samples = np.ones(self.class_count, dtype=np.uint32) * n_per
-
-        # Allocate extra
-        remaining = self.n_samples % self.class_count
-        if remaining != 0:
-            for i in range(remaining):
-                self.samples[i] += 1
-
-        assert self.samples.sum() == self.n_samples, \
-            "Error in equal allocation"
-
-    def sample_map(self, n_samples, seed=None):
+    def sample_map(self, seed=None, order=False, engine=None):
         """ Perform a stratified random sample on the map
 
+        Each map class is sampled according to the current allocation.
+
         Args:
-          n_samples (int):          number of samples
           seed (int, optional):     specify seed for RNG
+          order (bool, optional):   order samples by strata, or randomize
+          engine (str, optional):   sampling engine (see `samplers.sample`)
 
         Returns:
-          samples (ndarray):        Samples for each strata
+          samples (ndarray):        structured array with "stratum", "row"
+                                    and "col" of each sample
         """
-        pass
-
-
-
+        return self._sample('stratified', allocation=self.samples,
+                            seed=seed, order=order, engine=engine)
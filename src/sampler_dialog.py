@@ -33,6 +33,7 @@ from PyQt4 import QtGui
 
 import qgis.core
 
+from histogram import in_classes, raster_histogram
 from ui_sampler import Ui_AccuracyAssessSampler as Ui_Dialog
 
 logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s',
@@ -85,7 +86,7 @@ class SamplerDialog(QtGui.QDialog, Ui_Dialog):
 
     # Initialize map dataset variables
     _map_ds = None
-    _map = None
+    _map_hist = None
     _map_size = 1
 
     _map_values = None
@@ -174,8 +175,9 @@ class SamplerDialog(QtGui.QDialog, Ui_Dialog):
 
         self.map_band = map_band
 
-        # Read in band
-        self._map = self._map_ds.GetRasterBand(self.map_band).ReadAsArray()
+        # Count map classes
+        self._map_hist = raster_histogram(
+            self._map_ds.GetRasterBand(self.map_band))
         self.gui_output_onoff()
         logger.debug('Opened map')
 
@@ -233,7 +235,7 @@ class SamplerDialog(QtGui.QDialog, Ui_Dialog):
         """ Read the map image and find map categories """
         # Get unique values
         logger.debug('Reading in map values')
-        unique_values = np.unique(self._map)
+        unique_values = self._map_hist[0]
         self._map_values = unique_values.copy()
 
         # Get categories names
@@ -298,21 +300,18 @@ class SamplerDialog(QtGui.QDialog, Ui_Dialog):
 
     def get_map_percents(self):
         """ Calculate map for each class """
-        # Find mask
-        logger.debug('Finding ')
-        mask = np.ones_like(self._map)
-        for val in self.map_mask_val:
-            logger.debug('    masked value {v}'.format(v=val))
-            mask *= self._map != val
-
-        # Get total number of pixcels in image
-        n_pix = mask.sum()
+        classes, counts = self._map_hist
+
+        # Get total number of unmasked pixels in image
+        logger.debug('Finding unmasked pixels')
+        unmasked = ~in_classes(classes, self.map_mask_val)
+        n_pix = counts[unmasked].sum()
         logger.debug('Calculated unmasked size: {n}'.format(n=n_pix))
 
         # Find totals per class
-        totals = np.zeros(len(self._map_value_display))
-        for i, val in enumerate(self._map_value_display):
-            totals[i] = (self._map == val).sum()
+        display = np.asarray(self._map_value_display)
+        idx = np.clip(np.searchsorted(classes, display), 0, classes.size - 1)
+        totals = np.where(classes[idx] == display, counts[idx], 0)
 
         # Find percents
         self._map_value_percent = totals / n_pix * 100.0
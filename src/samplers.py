@@ -0,0 +1,1385 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ AccuracySampler
+
+ Plugin for generating random samples from maps for accuracy assessment
+                             -------------------
+        begin                : 2014-07-30
+        copyright            : (C) 2014 by Chris Holden
+        email                : ceholden@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Random, stratified random and systematic samplers for classification maps
+ held in memory or read from GDAL raster bands.
+
+ Samplers fill and return a structured array of sample records (see
+ `sample_dtype`), allocated once at its final size, and raise ValueError for
+ designs that cannot be sampled.
+"""
+from __future__ import division
+
+import logging
+import multiprocessing
+
+import numpy as np
+try:
+    from osgeo import gdal
+except:
+    import gdal
+
+from allocation import allocate, sample_size
+from histogram import (block_windows, class_histogram, class_lookup,
+                       in_classes, lookup_values, merge_histograms,
+                       raster_histogram)
+from rawraster import MemmapBand, mapped_band
+
+logger = logging.getLogger(__name__)
+
+ENGINES = ['memory', 'block', 'reservoir']
+
+_population_error = ('Sample size ({n}) greater than population of all '
+                     'classes included ({N})')
+
+# Smallest fraction of valid pixels for drawing simple random samples by
+#   rejection
+_REJECTION_MIN_FRACTION = 0.05
+
+# Approximate number of pixels in each strip of an image read at once
+_STRIP_PIXELS = 2 ** 20
+
+# GDAL datasets and raster bands opened by each batch sampling process
+_process_datasets = {}
+_process_bands = {}
+
+# Number of windows given to a batch sampling process at once
+_BATCH_CHUNK = 4
+
+
+def _seed_sequence(seed):
+    """ Return `seed` as a np.random.SeedSequence """
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+    return np.random.SeedSequence(seed)
+
+
+def _streams(seed, n):
+    """
+    Return `n` independent random number generators spawned from `seed`
+
+    Each stratum, tile or task draws from its own child stream, so its draws
+    do not depend on the order in which other streams are used.
+
+    Args:
+        seed (int or SeedSequence)  seed of parent stream
+        n (int)                 number of child streams
+
+    Return:
+        list                    np.random.Generator for each child stream
+    """
+    return [np.random.default_rng(s) for s in _seed_sequence(seed).spawn(n)]
+
+
+def choose(rng, population, n):
+    """
+    Return `n` distinct integers drawn uniformly at random from
+    ``range(population)``
+
+    Small samples of large populations are drawn by rejection: random integers
+    are drawn in batches and repeated draws are discarded, so the cost depends
+    on `n` and not on `population`. Samples of more than half of the
+    population are taken from a random permutation.
+
+    Args:
+        rng (np.random.Generator)   random number generator
+        population (int)        population size
+        n (int)                 sample size
+
+    Return:
+        ndarray                 sampled integers in random order
+    """
+    population, n = int(population), int(n)
+    if n > population:
+        raise ValueError(_population_error.format(n=n, N=population))
+    if 2 * n > population:
+        return rng.permutation(population)[:n]
+
+    selected = np.empty(0, dtype=np.int64)
+    while selected.size < n:
+        need = n - selected.size
+        candidates = np.concatenate(
+            (selected, rng.integers(population, size=need + need // 2 + 1)))
+        # Keep first draw of each integer, in order drawn
+        _, first = np.unique(candidates, return_index=True)
+        selected = candidates[np.sort(first)][:n]
+
+    return selected
+
+
+def sample_dtype(class_dtype):
+    """
+    Return data type of sample records
+
+    Strata are stored with the data type of the map classes and rows and
+    columns as unsigned 32 bit integers, which hold the size of any GDAL
+    raster.
+
+    Args:
+        class_dtype (np.dtype)  data type of map classes
+
+    Return:
+        np.dtype                structured data type with "stratum", "row"
+                                and "col" fields
+    """
+    return np.dtype([('stratum', np.dtype(class_dtype).newbyteorder('=')),
+                     ('row', np.uint32),
+                     ('col', np.uint32)])
+
+
+def _empty_records(n, classes):
+    """ Return uninitialized records for `n` samples of map `classes` """
+    return np.empty(int(n), dtype=sample_dtype(np.asarray(classes).dtype))
+
+
+def _set_pixels(records, flat, ncol):
+    """ Set rows and columns of `records` from flat pixel indices """
+    rows, cols = np.divmod(np.asarray(flat, dtype=np.int64), ncol)
+    records['row'] = rows
+    records['col'] = cols
+
+
+def _group_by_class(image, classes):
+    """
+    Group flat pixel indices of `image` by class in a single pass
+
+    Each pixel is matched against the sorted `classes` once, using a lookup
+    table for 8 and 16 bit maps (see `histogram.class_lookup`), and the
+    matching pixel indices are sorted by their class index so that the pixels
+    of each class are stored contiguously.
+
+    Args:
+        image (ndarray)         input map image
+        classes (ndarray)       map image classes to be grouped
+
+    Return:
+        (index, start, size)    tuple of ndarrays: flat pixel indices grouped
+                                by class, and the offset into `index` and
+                                number of pixels for each class
+    """
+    classes = np.asarray(classes)
+    flat = image.ravel()
+
+    lookup = class_lookup(classes, flat.dtype, index=True)
+    if lookup is not None:
+        # Position of each pixel's value within classes
+        pos = lookup_values(lookup, flat)
+        index = np.flatnonzero(pos >= 0)
+        pos = pos[index]
+    else:
+        # Position of each pixel's value within the sorted classes
+        sorter = np.argsort(classes, kind='mergesort')
+        pos = np.searchsorted(classes[sorter], flat)
+        np.clip(pos, 0, classes.size - 1, out=pos)
+        match = classes[sorter][pos] == flat
+
+        index = np.flatnonzero(match)
+        pos = sorter[pos[match]]
+
+    # Stable sort keeps pixels in raster order within each class
+    index = index[np.argsort(pos, kind='mergesort')]
+    size = np.bincount(pos, minlength=classes.size)
+    start = np.concatenate(([0], np.cumsum(size)[:-1]))
+
+    return (index, start, size)
+
+
+def random_stratified(image, classes, counts, seed=None):
+    """
+    Return pixel strata, row, column from within image from a random stratified
+    sample of classes specified
+
+    Pixel locations for all classes are found in a single pass over `image`
+    before each stratum is sampled.
+
+    Args:
+        image (ndarray)         input map image
+        classes (ndarray)       map image classes to be sampled
+        counts (ndarray)        map image class sample counts
+        seed (int or SeedSequence)  seed for random number streams
+
+    Return:
+        ndarray                 sample records
+    """
+    classes = np.asarray(classes)
+    counts = np.array(counts, dtype=np.int64)
+
+    logger.debug('Grouping pixels by class')
+    index, start, size = _group_by_class(image, classes)
+
+    # Check for sample size > population size
+    over = counts > size
+    for c in classes[over]:
+        logger.warning(
+            'Class {0} sample size larger than population'.format(c))
+        logger.warning('Reducing sample count to size of population')
+    counts[over] = size[over]
+
+    logger.debug('Performing sampling')
+
+    records = _empty_records(counts.sum(), classes)
+    records['stratum'] = np.repeat(classes, counts)
+    offset = np.concatenate(([0], np.cumsum(counts)))
+    for c, i, N, n, o, rng in zip(classes, start, size, counts, offset,
+                                  _streams(seed, classes.size)):
+        logger.debug('Sampling class {c}'.format(c=c))
+
+        # Randomly sample x / y without replacement
+        _set_pixels(records[o:o + n], index[i + choose(rng, N, n)],
+                    image.shape[1])
+
+        logger.debug('    collected samples')
+
+    return records
+
+
+def _reject_flat(image, classes, count, fraction, rng):
+    """
+    Return flat indices of a simple random sample of pixels in `classes`,
+    drawn by rejection
+
+    Flat indices are drawn uniformly over the whole image in batches sized
+    from the expected fraction of valid pixels, and indices drawn more than
+    once or falling on other classes are rejected. The first `count` valid
+    indices in the order drawn are a simple random sample of valid pixels.
+
+    Args:
+        image (ndarray)         input map image
+        classes (ndarray)       map image classes to be sampled
+        count (int)             sample count
+        fraction (float)        fraction of pixels in `classes`
+        rng (np.random.Generator)   random number generator
+
+    Return:
+        ndarray                 flat pixel indices
+    """
+    lookup = class_lookup(classes, image.dtype)
+    drawn = np.empty(0, dtype=np.int64)
+    valid = np.empty(0, dtype=bool)
+    while valid.sum() < count:
+        need = count - valid.sum()
+        candidates = np.concatenate(
+            (drawn, rng.integers(image.size,
+                                 size=int(need / fraction * 1.25) + 16)))
+        # Keep first draw of each index, in order drawn
+        _, first = np.unique(candidates, return_index=True)
+        drawn = candidates[np.sort(first)]
+
+        rows, cols = np.divmod(drawn, image.shape[1])
+        valid = in_classes(image[rows, cols], classes, lookup)
+
+    return drawn[valid][:count]
+
+
+def _select_flat_ranks(image, classes, ranks):
+    """
+    Return flat indices of the ranked occurrences of pixels in `classes`,
+    reading `image` a strip of rows at a time
+
+    Args:
+        image (ndarray)         input map image
+        classes (ndarray)       map image classes to be selected
+        ranks (ndarray)         sorted ranks of pixels to select, counting
+                                pixels in `classes` in raster order
+
+    Return:
+        ndarray                 flat pixel indices
+    """
+    ncol = image.shape[1]
+    strip = max(1, _STRIP_PIXELS // max(ncol, 1))
+    lookup = class_lookup(classes, image.dtype)
+    seen = 0
+    selected = []
+    for yoff in range(0, image.shape[0], strip):
+        valid = in_classes(image[yoff:yoff + strip], classes, lookup)
+        n = int(valid.sum())
+        lo, hi = np.searchsorted(ranks, [seen, seen + n])
+        if hi > lo:
+            index = np.flatnonzero(valid)[ranks[lo:hi] - seen]
+            selected.append(index + yoff * ncol)
+        seen += n
+
+    return np.concatenate(selected + [np.empty(0, dtype=np.int64)])
+
+
+def random_simple(image, classes, count, class_px=None, seed=None):
+    """
+    Return pixel strata, row, column from within image from a simple random
+    sample of classes specified. The strata returned will be all equal to 1
+    because there are no strata in a non-stratified design.
+
+    Flat pixel indices are drawn directly and only those sampled are
+    converted to rows and columns, so memory use depends on the sample size
+    and not on the size of `image`. If few pixels are in `classes`, ranks
+    of valid pixels are drawn instead and located one strip of rows at a
+    time.
+
+    Args:
+        image (ndarray)         input map image
+        classes (ndarray)       map image classes to be sampled
+        counts (ndarray)        map image class sample counts
+        class_px (ndarray)      map image class pixel counts, counted from
+                                `image` if not given
+        seed (int or SeedSequence)  seed for random number streams
+
+    Return:
+        ndarray                 sample records
+    """
+    # Check
+    if isinstance(count, np.ndarray):
+        if count.ndim > 1 or count[0].ndim > 1:
+            raise ValueError('Allocation for simple random sample must be '
+                             'one number (was {a})'.format(a=count))
+        else:
+            count = count[0]
+    count = int(count)
+
+    if class_px is None:
+        _classes, _class_px = class_histogram(image)
+        class_px = _class_px[in_classes(_classes, classes)]
+    population = int(np.sum(class_px))
+
+    if count > population:
+        raise ValueError(_population_error.format(n=count, N=population))
+
+    logger.debug('Performing sampling')
+    rng = np.random.default_rng(seed)
+    fraction = population / max(image.size, 1)
+    if count == 0:
+        sample = np.empty(0, dtype=np.int64)
+    elif fraction >= _REJECTION_MIN_FRACTION:
+        sample = _reject_flat(image, classes, count, fraction, rng)
+    else:
+        logger.debug('    locating ranked pixels of sparse classes')
+        ranks = choose(rng, population, count)
+        order = np.argsort(ranks)
+        sample = np.empty(count, dtype=np.int64)
+        sample[order] = _select_flat_ranks(image, classes, ranks[order])
+    logger.debug('    collected samples')
+
+    records = _empty_records(count, classes)
+    records['stratum'] = 1
+    _set_pixels(records, sample, image.shape[1])
+
+    return records
+
+
+def _select_ranks(band, classes, ranks):
+    """
+    Return flat pixel locations of the ranked occurrences of each class,
+    reading one block at a time
+
+    Pixels are ranked within each class in the order blocks are read and then
+    in raster order within each block.
+
+    Args:
+        band (gdal.Band)        raster band of map image
+        classes (ndarray)       map image classes to be sampled
+        ranks (list)            sorted ndarray of ranks to select per class
+
+    Return:
+        ndarray                 sample records
+    """
+    seen = np.zeros(len(classes), dtype=np.int64)
+    records = _empty_records(sum(r.size for r in ranks), classes)
+    n = 0
+
+    for xoff, yoff, xsize, ysize in block_windows(band):
+        block = band.ReadAsArray(xoff, yoff, xsize, ysize)
+        index, start, size = _group_by_class(block, classes)
+
+        for k, (c, r) in enumerate(zip(classes, ranks)):
+            # Ranks of class `c` falling within this block
+            lo, hi = np.searchsorted(r, [seen[k], seen[k] + size[k]])
+            if hi > lo:
+                row, col = np.divmod(index[start[k] + r[lo:hi] - seen[k]],
+                                     xsize)
+                found = records[n:n + hi - lo]
+                found['stratum'] = c
+                found['row'] = row + yoff
+                found['col'] = col + xoff
+                n += hi - lo
+            seen[k] += size[k]
+
+    return records[:n]
+
+
+def _stratified_ranks(classes, counts, class_px, seed=None):
+    """
+    Return sorted ranks of the pixels sampled from each class, for a random
+    stratified sample of classes whose pixel counts are known
+
+    Args:
+        classes (ndarray)       map image classes to be sampled
+        counts (ndarray)        map image class sample counts
+        class_px (ndarray)      map image class pixel counts
+        seed (int or SeedSequence)  seed for random number streams
+
+    Return:
+        list                    sorted ndarray of ranks to select per class
+    """
+    counts = np.array(counts, dtype=np.int64)
+    class_px = np.asarray(class_px)
+
+    # Check for sample size > population size
+    over = counts > class_px
+    for c in np.asarray(classes)[over]:
+        logger.warning(
+            'Class {0} sample size larger than population'.format(c))
+        logger.warning('Reducing sample count to size of population')
+    counts[over] = class_px[over]
+
+    return [np.sort(choose(rng, N, n)) for N, n, rng in
+            zip(class_px, counts, _streams(seed, counts.size))]
+
+
+def _simple_ranks(classes, count, class_px, seed=None):
+    """
+    Return sorted ranks of the pixels sampled from each class, for a simple
+    random sample of classes whose pixel counts are known
+
+    Args:
+        classes (ndarray)       map image classes to be sampled
+        count (int)             sample count
+        class_px (ndarray)      map image class pixel counts
+        seed (int or SeedSequence)  seed for random number streams
+
+    Return:
+        list                    sorted ndarray of ranks to select per class
+    """
+    if isinstance(count, np.ndarray):
+        count = count[0]
+    population = int(np.sum(class_px))
+
+    if count > population:
+        raise ValueError(_population_error.format(n=count, N=population))
+
+    sample = np.sort(choose(np.random.default_rng(seed), population, count))
+
+    # Split ranks over all classes into ranks within each class
+    offset = np.concatenate(([0], np.cumsum(class_px)))
+    k = np.searchsorted(offset, sample, side='right') - 1
+    return [sample[k == i] - offset[i] for i in range(len(classes))]
+
+
+def random_stratified_blocks(band, classes, counts, class_px, seed=None):
+    """
+    Return pixel strata, row, column from a random stratified sample of
+    classes specified, reading the map one block at a time
+
+    Requires two passes over the map: `class_px` holds the pixel count of each
+    class from the first pass (see `histogram.raster_histogram`), and the
+    pixels selected are located in a second pass.
+
+    Args:
+        band (gdal.Band)        raster band of map image
+        classes (ndarray)       map image classes to be sampled
+        counts (ndarray)        map image class sample counts
+        class_px (ndarray)      map image class pixel counts
+        seed (int or SeedSequence)  seed for random number streams
+
+    Return:
+        ndarray                 sample records
+    """
+    logger.debug('Performing sampling')
+    ranks = _stratified_ranks(classes, counts, class_px, seed=seed)
+
+    return _select_ranks(band, classes, ranks)
+
+
+def random_simple_blocks(band, classes, count, class_px, seed=None):
+    """
+    Return pixel strata, row, column from a simple random sample of classes
+    specified, reading the map one block at a time. The strata returned will
+    be all equal to 1 because there are no strata in a non-stratified design.
+
+    Args:
+        band (gdal.Band)        raster band of map image
+        classes (ndarray)       map image classes to be sampled
+        count (int)             sample count
+        class_px (ndarray)      map image class pixel counts
+        seed (int or SeedSequence)  seed for random number streams
+
+    Return:
+        ndarray                 sample records
+    """
+    logger.debug('Performing sampling')
+    ranks = _simple_ranks(classes, count, class_px, seed=seed)
+
+    records = _select_ranks(band, classes, ranks)
+    records['stratum'] = 1
+
+    return records
+
+
+def _uniform(rng):
+    """ Return a random float from the open interval (0, 1) """
+    u = 0.0
+    while u == 0.0:
+        u = rng.random()
+    return u
+
+
+class Reservoir(object):
+    """ Fixed size random sample without replacement of a stream of items
+
+    Items are added in batches and sampled using Algorithm L (Li, 1994), which
+    skips ahead over items that will not enter the reservoir instead of
+    drawing a random number for every item.
+
+    Args:
+        k (int):                reservoir size
+        rng (np.random.Generator, optional): random number generator
+
+    """
+    def __init__(self, k, rng=None):
+        self.k = int(k)
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.n = 0
+        self.items = np.zeros(self.k, dtype=np.int64)
+
+        self._w = 1.0
+        self._next = None
+
+    def _skip(self):
+        """ Find position in stream of next item to enter reservoir """
+        self._w *= np.exp(np.log(_uniform(self.rng)) / self.k)
+        self._next += int(np.log(_uniform(self.rng)) /
+                          np.log(1 - self._w)) + 1
+
+    def update(self, items):
+        """ Add a batch of items from the stream to the reservoir
+
+        Args:
+          items (ndarray):          next items in stream
+
+        """
+        start, end = self.n, self.n + items.size
+
+        # Fill reservoir with first `k` items
+        if start < self.k:
+            fill = min(self.k, end) - start
+            self.items[start:start + fill] = items[:fill]
+            if start + fill == self.k:
+                self._next = self.k - 1
+                self._skip()
+
+        # Replace random item in reservoir with items skipped to
+        while self._next is not None and self._next < end:
+            self.items[self.rng.integers(self.k)] = items[self._next - start]
+            self._skip()
+
+        self.n = end
+
+    @property
+    def sample(self):
+        """ ndarray: items currently in reservoir """
+        return self.items[:min(self.n, self.k)]
+
+
+def reservoir_blocks(band, k, mask=None, stratify=True, seed=None):
+    """
+    Count classes and keep reservoir samples of pixel locations from a raster
+    band in a single pass, reading one block at a time
+
+    Args:
+        band (gdal.Band)        raster band of map image
+        k (int)                 reservoir size
+        mask (ndarray)          values to exclude from reservoirs
+        stratify (bool)         keep a reservoir for each class if True, or
+                                one reservoir for all unmasked pixels, keyed
+                                as None, if False
+        seed (int or SeedSequence)  seed for random number streams, with a
+                                stream spawned for each reservoir in the order
+                                reservoirs are created
+
+    Return:
+        (classes, class_px, reservoirs)     tuple of ndarray of classes,
+                                            ndarray of class pixel counts and
+                                            dict of Reservoir
+    """
+    seed = _seed_sequence(seed)
+    totals = {}
+    reservoirs = {}
+
+    for xoff, yoff, xsize, ysize in block_windows(band):
+        block = band.ReadAsArray(xoff, yoff, xsize, ysize)
+        block_classes = np.unique(block)
+        masked = in_classes(block_classes, mask)
+
+        index, start, size = _group_by_class(block, block_classes)
+
+        for c, m, i, n in zip(block_classes, masked, start, size):
+            totals[c] = totals.get(c, 0) + n
+            if m:
+                continue
+
+            # Flat pixel location within the whole map
+            row, col = np.divmod(index[i:i + n], xsize)
+            flat = (row + yoff) * band.XSize + col + xoff
+
+            key = c if stratify else None
+            if key not in reservoirs:
+                reservoirs[key] = Reservoir(k, _streams(seed, 1)[0])
+            reservoirs[key].update(flat)
+
+    classes = np.array(sorted(totals))
+    class_px = np.array([totals[c] for c in classes], dtype=np.int64)
+
+    return (classes, class_px, reservoirs)
+
+
+def random_stratified_reservoir(reservoirs, classes, counts, shape,
+                                seed=None):
+    """
+    Return pixel strata, row, column from a random stratified sample of
+    classes specified using reservoir samples of each class
+
+    Each reservoir must hold at least as many pixels as are allocated to its
+    class, unless the class population is smaller than its allocation.
+
+    Args:
+        reservoirs (dict)       Reservoir of pixel locations for each class
+        classes (ndarray)       map image classes to be sampled
+        counts (ndarray)        map image class sample counts
+        shape (tuple)           number of rows and columns in map image
+        seed (int or SeedSequence)  seed for random number streams
+
+    Return:
+        ndarray                 sample records
+    """
+    counts = np.array(counts, dtype=np.int64)
+
+    # Check for sample size > population size
+    size = np.array([reservoirs[c].sample.size for c in classes],
+                    dtype=np.int64)
+    over = counts > size
+    for c in np.asarray(classes)[over]:
+        logger.warning(
+            'Class {0} sample size larger than population'.format(c))
+        logger.warning('Reducing sample count to size of population')
+    counts[over] = size[over]
+
+    logger.debug('Performing sampling')
+    records = _empty_records(counts.sum(), classes)
+    records['stratum'] = np.repeat(classes, counts)
+    offset = np.concatenate(([0], np.cumsum(counts)))
+    for c, N, n, o, rng in zip(classes, size, counts, offset,
+                               _streams(seed, len(classes))):
+        # A random subset of the reservoir is a random sample of the class
+        pixels = reservoirs[c].sample
+        _set_pixels(records[o:o + n], pixels[choose(rng, N, n)], shape[1])
+
+    return records
+
+
+def random_simple_reservoir(reservoir, count, shape, class_dtype,
+                            seed=None):
+    """
+    Return pixel strata, row, column from a simple random sample using a
+    reservoir sample of all unmasked pixels. The strata returned will be all
+    equal to 1 because there are no strata in a non-stratified design.
+
+    Args:
+        reservoir (Reservoir)   reservoir of unmasked pixel locations
+        count (int)             sample count
+        shape (tuple)           number of rows and columns in map image
+        class_dtype (np.dtype)  data type of map classes
+        seed (int or SeedSequence)  seed for random number streams
+
+    Return:
+        ndarray                 sample records
+    """
+    if isinstance(count, np.ndarray):
+        count = count[0]
+
+    if count > reservoir.n:
+        raise ValueError(_population_error.format(n=count, N=reservoir.n))
+
+    logger.debug('Performing sampling')
+    pixels = reservoir.sample
+    sample = pixels[choose(np.random.default_rng(seed), pixels.size, count)]
+
+    records = np.empty(int(count), dtype=sample_dtype(class_dtype))
+    records['stratum'] = 1
+    _set_pixels(records, sample, shape[1])
+
+    return records
+
+
+def _systematic_grid(shape, step, rng):
+    """
+    Return rows and columns of a systematic grid with a random start
+
+    Args:
+        shape (tuple)           number of rows and columns in map image
+        step (int)              distance in pixels between grid rows and
+                                between grid columns
+        rng (np.random.Generator)   random number generator
+
+    Return:
+        (rows, cols)            tuple of ndarrays of grid row and column
+                                coordinates
+    """
+    nrow, ncol = shape
+    row0, col0 = rng.integers([min(step, nrow), min(step, ncol)])
+
+    return (np.arange(row0, nrow, step), np.arange(col0, ncol, step))
+
+
+def _read_grid(image, rows, cols):
+    """
+    Return map image values at every intersection of grid `rows` and `cols`
+
+    Arrays are read with a strided view. Raster bands are read with one
+    window per grid row spanning only the grid columns.
+
+    Args:
+        image (ndarray or gdal.Band)    map image or raster band of map image
+        rows (ndarray)          evenly spaced grid rows
+        cols (ndarray)          evenly spaced grid columns
+
+    Return:
+        ndarray                 map image values with a row for each grid row
+                                and a column for each grid column
+    """
+    if rows.size == 0 or cols.size == 0:
+        return np.empty((rows.size, cols.size), dtype=np.int64)
+
+    if isinstance(image, MemmapBand):
+        image = image.array
+    if isinstance(image, np.ndarray):
+        row_step = rows[1] - rows[0] if rows.size > 1 else 1
+        col_step = cols[1] - cols[0] if cols.size > 1 else 1
+        return image[rows[0]::row_step, cols[0]::col_step][:rows.size,
+                                                            :cols.size]
+
+    xoff, xsize = cols[0], cols[-1] - cols[0] + 1
+    return np.vstack([image.ReadAsArray(int(xoff), int(row), int(xsize), 1)
+                      [0, cols - xoff] for row in rows])
+
+
+def random_systematic(image, classes, counts, class_px=None, stratify=False,
+                      seed=None, mask=None):
+    """
+    Return pixel strata, row, column from a systematic sample of classes
+    specified
+
+    Samples are taken from a grid of pixels spaced a fixed number of rows
+    and columns apart, starting from a random offset. Only the map values at
+    the grid are read, so the cost depends on the sample size rather than the
+    size of the map.
+
+    Without stratification, the grid spacing is first chosen from the size
+    of the map to give about `counts` grid pixels, and is narrowed until at
+    least `counts` grid pixels are unmasked, so the class pixel counts are not
+    needed. The strata returned will be all equal to 1. With stratification,
+    the grid spacing is chosen so that every class is expected to have at
+    least as many grid pixels as allocated, and is narrowed until every class
+    does, and the allocated number of grid pixels is randomly kept from each
+    class.
+
+    Args:
+        image (ndarray or gdal.Band)    map image or raster band of map image
+        classes (ndarray)       map image classes to be sampled, or None to
+                                sample all classes on the grid not in `mask`
+                                without stratification
+        counts (ndarray)        map image class sample counts, or sample count
+        class_px (ndarray)      map image class pixel counts, needed only
+                                with stratification
+        stratify (bool)         stratify sample by class
+        seed (int or SeedSequence)  seed for random number streams
+        mask (ndarray)          values to exclude if `classes` is None
+
+    Return:
+        ndarray                 sample records
+    """
+    if isinstance(image, np.ndarray):
+        shape = image.shape
+    else:
+        shape = (image.YSize, image.XSize)
+    counts = np.atleast_1d(np.array(counts, dtype=np.int64))
+
+    # Pixels per sample in the most densely allocated stratum, or in the map
+    if stratify:
+        classes = np.asarray(classes)
+        class_px = np.asarray(class_px, dtype=np.float64)
+        allocated = counts > 0
+        density = np.min(class_px[allocated] / counts[allocated]) \
+            if allocated.any() else 1
+    else:
+        density = shape[0] * shape[1] / max(counts[0], 1)
+    step = max(1, int(np.sqrt(density)))
+
+    grid_seed, sample_seed = _seed_sequence(seed).spawn(2)
+    grid_rng = np.random.default_rng(grid_seed)
+    while True:
+        logger.debug('Systematic grid spacing is {s} pixels'.format(s=step))
+        grid_rows, grid_cols = _systematic_grid(shape, step, grid_rng)
+        values = _read_grid(image, grid_rows, grid_cols)
+        logger.debug('Read {n} grid pixels'.format(n=values.size))
+
+        if stratify or classes is not None:
+            grid_classes = np.asarray(classes)
+        else:
+            grid_classes = class_histogram(values)[0]
+            grid_classes = grid_classes[~in_classes(grid_classes, mask)]
+        index, start, size = _group_by_class(values, grid_classes)
+
+        if step == 1 or values.size == 0:
+            break
+        if stratify:
+            # Narrow grid if any class has fewer grid pixels than allocated
+            short = counts > size
+            if not short.any():
+                break
+            fraction = np.min(size[short] / counts[short])
+            step = max(1, min(step - 1, int(step * np.sqrt(fraction))))
+        else:
+            # Narrow grid spaced from map size if too many pixels are masked
+            if index.size >= counts[0]:
+                break
+            fraction = index.size / values.size
+            step = max(1, min(step - 1, int(np.sqrt(fraction * density))))
+    classes = grid_classes
+
+    if stratify:
+        over = counts > size
+        for c in classes[over]:
+            logger.warning(
+                'Class {0} sample size larger than grid pixels in class'.
+                format(c))
+            logger.warning('Reducing sample count to grid pixels in class')
+        counts[over] = size[over]
+
+        samples = [i + choose(rng, N, n) for i, N, n, rng in
+                   zip(start, size, counts,
+                       _streams(sample_seed, classes.size))]
+        samples = index[np.concatenate(samples + [[]]).astype(np.int64)]
+        records = _empty_records(samples.size, classes)
+        records['stratum'] = np.repeat(classes, counts)
+    else:
+        if index.size < counts[0]:
+            logger.warning('Sample size larger than unmasked grid pixels')
+            logger.warning('Reducing sample count to {n}'.format(
+                n=index.size))
+        samples = np.sort(index)
+        if samples.size > counts[0]:
+            rng = np.random.default_rng(sample_seed)
+            samples = np.sort(samples[choose(rng, samples.size, counts[0])])
+        records = _empty_records(samples.size, classes)
+        records['stratum'] = 1
+
+    grid_row, grid_col = np.divmod(samples, values.shape[1])
+    records['row'] = grid_rows[grid_row]
+    records['col'] = grid_cols[grid_col]
+
+    return records
+
+
+def _order_records(records, order, seed):
+    """
+    Return sample records ordered by strata, keeping the order drawn within
+    each stratum, or in a random order
+
+    Args:
+        records (ndarray)       sample records
+        order (bool)            order by strata, or randomize
+        seed (SeedSequence)     seed for random order
+
+    Return:
+        ndarray                 sample records
+    """
+    if order is True:
+        return records[np.argsort(records['stratum'], kind='mergesort')]
+
+    logger.debug('Randomizing order of samples')
+    return records[np.random.default_rng(seed).permutation(records.size)]
+
+
+def _variance_size(histogram, mask, allocation, users_accuracy, target_se):
+    """
+    Return sample size estimated for a target standard error of overall
+    accuracy from the class histogram of a map
+
+    Args:
+        histogram (tuple)       classes and pixel count of each class
+        mask (list or ndarray)  values to exclude from the map
+        allocation (str, list or ndarray)   allocation, or None for a simple
+                                random sample
+        users_accuracy (float or ndarray)   expected user's accuracy
+        target_se (float)       target standard error of overall accuracy
+
+    Return:
+        int                     sample size
+    """
+    classes, class_px = histogram
+    class_px = class_px[~in_classes(classes, mask)]
+    size = sample_size(class_px, users_accuracy, target_se,
+                       stratified=allocation is not None)
+    logger.debug('Estimated sample size of {n} for standard error of '
+                 '{se}'.format(n=size, se=target_se))
+
+    return size
+
+
+def _sample_counts(method, classes, class_px, size, allocation,
+                   users_accuracy=None, minimum=50):
+    """
+    Return sample count of each unmasked class, or the total sample count for
+    unallocated designs
+
+    Args:
+        method (str)            sampling method
+        classes (ndarray)       unmasked map classes
+        class_px (ndarray)      unmasked map class pixel counts
+        size (int)              total sample size
+        allocation (str, list or ndarray)   allocation strategy, allocation
+                                of each class, or None
+        users_accuracy (float or ndarray)   expected user's accuracy for
+                                "neyman" allocation
+        minimum (int)           minimum samples per class for
+                                "good_practices" allocation
+
+    Return:
+        int or ndarray          sample counts
+    """
+    # Determine class counts from allocation type and total sample size
+    if allocation is None:
+        counts = size
+    elif isinstance(allocation, str):
+        # If allocationd determined by method, we must specify a size
+        if not isinstance(size, (int, np.integer)):
+            raise TypeError('Must specify sample size if allocation to '
+                            'calculate allocation')
+        counts = allocate(allocation, size, class_px,
+                          users_accuracy=users_accuracy, minimum=minimum,
+                          maximum=class_px)
+        logger.debug('Allocated samples {a}'.format(a=counts))
+
+    # Or use specified allocation
+    elif isinstance(allocation, list):
+        counts = np.array(allocation)
+    elif isinstance(allocation, np.ndarray):
+        if allocation.ndim != 1:
+            raise TypeError('Allocation must be 1D array')
+        counts = allocation
+    else:
+        raise TypeError(
+            'Allocation must be a str for a method, or a list/np.ndarray')
+
+    # Ensure we found allocation for each class if stratified
+    if method == 'stratified' or (method == 'systematic' and
+                                  allocation is not None):
+        if classes.size != counts.size:
+            raise ValueError(
+                'Sample counts must be given for each unmasked class in map')
+
+    return counts
+
+
+def sample(image, method,
+           size=None, allocation=None,
+           mask=None, order=False, engine='memory', histogram=None,
+           users_accuracy=None, target_se=0.01, minimum=50, seed=None):
+    """
+    Make sampling decisions and perform sampling
+
+    Args:
+      image (np.ndarray or gdal.Band): array of the image, or raster band of
+        the image for the "block" and "reservoir" engines
+      method (str): Sampling method
+      size (int or str, optional): Total sample size, or "variance" to
+        estimate sample size from `users_accuracy` and `target_se`
+      allocation (str, or list/np.ndarray): Allocation strategy specified as a
+        string, or user specified allocation as list or np.ndarray
+      mask (list or np.ndarray, optional): Values to exclude from `image`
+      order (bool, optional): Order the output by strata, or not
+      engine (str, optional): Sampling engine - "memory" to sample an array,
+        "block" to read `image` by block in two passes, or "reservoir" to read
+        `image` by block in one pass
+      histogram (tuple, optional): classes and pixel count of each class in
+        `image`, if already known, for the "memory" and "block" engines
+      users_accuracy (float or np.ndarray, optional): Expected user's
+        accuracy of all unmasked classes, or of each unmasked class, for
+        "neyman" allocation and "variance" sample size
+      target_se (float, optional): Target standard error of overall accuracy
+        for "variance" sample size
+      minimum (int, optional): Minimum samples per class for
+        "good_practices" allocation
+      seed (int or np.random.SeedSequence, optional): Seed for random number
+        streams. Reservoirs, sampling and ordering each draw from their own
+        child stream, so samples are reproducible for a given seed
+
+    Returns:
+        output (np.ndarray): sample records with "stratum", "row" and "col"
+          fields (see `sample_dtype`)
+
+    """
+    # Systematic samples only read the grid, so never fill reservoirs
+    if method == 'systematic' and engine == 'reservoir':
+        engine = 'block'
+
+    reservoir_seed, sample_seed, order_seed = _seed_sequence(seed).spawn(3)
+
+    # Estimate sample size from class proportions before sampling
+    if size == 'variance':
+        if histogram is None:
+            if isinstance(image, np.ndarray):
+                histogram = class_histogram(image)
+            else:
+                histogram = raster_histogram(image)
+        size = _variance_size(histogram, mask, allocation, users_accuracy,
+                              target_se)
+
+    # Unstratified systematic samples are spaced from the map size, reading
+    #   only the grid
+    if method == 'systematic' and allocation is None:
+        records = random_systematic(image, None, size, seed=sample_seed,
+                                    mask=mask)
+        return _order_records(records, order, order_seed)
+
+    # Find map classes within image
+    if histogram is not None and engine != 'reservoir':
+        classes, class_px = histogram
+        n_px = class_px.sum()
+    elif engine == 'memory':
+        classes, class_px = class_histogram(image)
+        n_px = image.size
+    elif engine == 'block':
+        logger.debug('Counting map classes one block at a time')
+        classes, class_px = raster_histogram(image)
+        n_px = image.XSize * image.YSize
+    elif engine == 'reservoir':
+        # Reservoirs must be big enough for any class allocation
+        if isinstance(allocation, (list, np.ndarray)):
+            k = np.max(allocation)
+        else:
+            k = size
+        logger.debug('Collecting reservoirs of {k} pixels one block at a '
+                     'time'.format(k=k))
+        classes, class_px, reservoirs = reservoir_blocks(
+            image, k, mask=mask, stratify=method == 'stratified',
+            seed=reservoir_seed)
+        n_px = image.XSize * image.YSize
+    else:
+        raise ValueError('Unknown sampling engine {e}'.format(e=engine))
+
+    # Exclude masked values
+    unmasked = ~in_classes(classes, mask)
+    classes, class_px = classes[unmasked], class_px[unmasked]
+
+    logger.debug('Found {n} classes'.format(n=classes.size))
+    for c, px in zip(classes, class_px):
+        logger.debug(
+            '    class {c} - {pix}px ({pct}%)'.format(
+                c=c,
+                pix=px,
+                pct=np.round(float(px) / n_px * 100.0, decimals=2)))
+
+    counts = _sample_counts(method, classes, class_px, size, allocation,
+                            users_accuracy=users_accuracy, minimum=minimum)
+
+    # Perform sample using desired method
+    if method == 'stratified' and engine == 'reservoir':
+        records = random_stratified_reservoir(
+            reservoirs, classes, counts, (image.YSize, image.XSize),
+            seed=sample_seed)
+    elif method == 'stratified' and engine == 'block':
+        records = random_stratified_blocks(image, classes, counts, class_px,
+                                           seed=sample_seed)
+    elif method == 'stratified':
+        records = random_stratified(image, classes, counts, seed=sample_seed)
+    elif method == 'random' and engine == 'reservoir':
+        records = random_simple_reservoir(
+            reservoirs.get(None, Reservoir(0)), counts,
+            (image.YSize, image.XSize), classes.dtype, seed=sample_seed)
+    elif method == 'random' and engine == 'block':
+        records = random_simple_blocks(image, classes, counts, class_px,
+                                       seed=sample_seed)
+    elif method == 'random':
+        records = random_simple(image, classes, counts, class_px=class_px,
+                                seed=sample_seed)
+    elif method == 'systematic':
+        records = random_systematic(
+            image, classes, counts, class_px,
+            stratify=allocation is not None, seed=sample_seed)
+
+    return _order_records(records, order, order_seed)
+
+
+def _close_batch_datasets():
+    """ Forget datasets opened for batch sampling in the current process,
+    including those inherited by a batch sampling process from its parent
+    """
+    _process_bands.clear()
+    _process_datasets.clear()
+
+
+def _process_band(filename, bidx):
+    """ Return raster band opened by and for use only in the current process,
+    memory-mapped if possible
+    """
+    key = (filename, bidx)
+    if key not in _process_bands:
+        if filename not in _process_datasets:
+            _process_datasets[filename] = gdal.Open(filename,
+                                                    gdal.GA_ReadOnly)
+        _process_bands[key] = mapped_band(
+            _process_datasets[filename].GetRasterBand(bidx))
+    return _process_bands[key]
+
+
+def _batch_histograms(job):
+    """ Return class histogram of the same window of each map """
+    maps, window = job
+    return [class_histogram(_process_band(f, b).ReadAsArray(*window))
+            for f, b in maps]
+
+
+def _batch_select(job):
+    """ Return records of the ranked pixels of each class of each map within
+    the same window of each map, or None for maps without samples in window
+    """
+    maps, window, selections = job
+    xoff, yoff, xsize, ysize = window
+
+    output = []
+    for (f, b), selection in zip(maps, selections):
+        if selection is None:
+            output.append(None)
+            continue
+        classes, ranks = selection
+        block = _process_band(f, b).ReadAsArray(*window)
+        index, start, size = _group_by_class(block, classes)
+
+        records = _empty_records(sum(r.size for r in ranks), classes)
+        records['stratum'] = np.repeat(classes, [r.size for r in ranks])
+        row, col = np.divmod(np.concatenate(
+            [index[i + r] for i, r in zip(start, ranks)]), xsize)
+        records['row'] = row + yoff
+        records['col'] = col + xoff
+        output.append(records)
+
+    return output
+
+
+def _batch_systematic(job):
+    """ Return systematic sample of one map """
+    filename, bidx, classes, counts, class_px, stratify, seed = job
+    return random_systematic(_process_band(filename, bidx), classes, counts,
+                             class_px, stratify=stratify, seed=seed)
+
+
+def _window_ranks(classes, ranks, partials):
+    """
+    Split ranks of pixels within each class of a map into ranks within each
+    block window
+
+    Args:
+        classes (ndarray)       map image classes sampled
+        ranks (list)            sorted ndarray of ranks selected per class
+        partials (list)         class histogram of each window of the map
+
+    Return:
+        dict                    list of ranks selected per class, keyed by
+                                window number, for windows with samples
+    """
+    # Pixels of each class within each window
+    window_px = np.zeros((len(partials), classes.size), dtype=np.int64)
+    if classes.size:
+        values = np.concatenate([h[0] for h in partials])
+        counts = np.concatenate([h[1] for h in partials])
+        windows = np.repeat(np.arange(len(partials)),
+                            [h[0].size for h in partials])
+        k = np.clip(np.searchsorted(classes, values), 0, classes.size - 1)
+        found = classes[k] == values
+        window_px[windows[found], k[found]] = counts[found]
+    end = np.cumsum(window_px, axis=0)
+
+    selected = {}
+    for k, r in enumerate(ranks):
+        if r.size == 0:
+            continue
+        w = np.searchsorted(end[:, k], r, side='right')
+        local = r - (end[w, k] - window_px[w, k])
+        split = np.flatnonzero(np.diff(w)) + 1
+        for i, local_ranks in zip(w[np.concatenate(([0], split))],
+                                  np.split(local, split)):
+            if i not in selected:
+                selected[i] = [np.empty(0, dtype=np.int64)] * classes.size
+            selected[i][k] = local_ranks
+
+    return selected
+
+
+def sample_batch(maps, method,
+                 size=None, allocation=None,
+                 mask=None, order=False,
+                 users_accuracy=None, target_se=0.01, minimum=50, seed=None,
+                 n_processes=1):
+    """
+    Sample many maps on the same grid, sharing reads of each block window
+
+    Maps are read one block window at a time, using the windows of the first
+    map, and the same window of every map is read by the same process one
+    after another. Bands of one file therefore share reads through the GDAL
+    block cache, or the operating system's page cache for memory-mapped
+    bands (see `rawraster.mapped_band`). A first pass counts the classes of
+    every map within each window, and the pixels sampled from every map are
+    located in a second pass that reads only windows containing samples.
+    Windows are divided among a pool of processes that each open their own
+    handle to each dataset.
+
+    Each map is sampled as by `sample` using the "block" engine, with its own
+    seed spawned from `seed`.
+
+    Args:
+      maps (list): (filename, band number) of each map
+      method (str): Sampling method
+      size (int or str, optional): Total sample size of each map, or
+        "variance" to estimate sample size of each map from `users_accuracy`
+        and `target_se`
+      allocation (str, or list/np.ndarray): Allocation strategy specified as a
+        string, or user specified allocation as list or np.ndarray
+      mask (list or np.ndarray, optional): Values to exclude from maps
+      order (bool, optional): Order the output by strata, or not
+      users_accuracy (float or np.ndarray, optional): Expected user's
+        accuracy of all unmasked classes, or of each unmasked class
+      target_se (float, optional): Target standard error of overall accuracy
+        for "variance" sample size
+      minimum (int, optional): Minimum samples per class for
+        "good_practices" allocation
+      seed (int or np.random.SeedSequence, optional): Seed for random number
+        streams, with a child stream spawned for each map
+      n_processes (int, optional): Number of processes
+
+    Returns:
+        output (list): sample records of each map (see `sample`)
+
+    """
+    if method not in ('random', 'stratified', 'systematic'):
+        raise ValueError('Unknown sampling method {m}'.format(m=method))
+    maps = [(str(f), int(b)) for f, b in maps]
+    if not maps:
+        return []
+
+    shapes = set()
+    for f, b in maps:
+        ds = gdal.Open(f, gdal.GA_ReadOnly)
+        band = ds.GetRasterBand(b)
+        shapes.add((band.YSize, band.XSize))
+        if len(shapes) > 1:
+            raise ValueError('Maps must have the same number of rows and '
+                             'columns to be sampled together')
+    ds = gdal.Open(maps[0][0], gdal.GA_ReadOnly)
+    windows = list(block_windows(mapped_band(ds.GetRasterBand(maps[0][1]))))
+    ds, band = None, None
+
+    pool = None
+    if n_processes > 1:
+        pool = multiprocessing.Pool(n_processes,
+                                    initializer=_close_batch_datasets)
+
+    def run(func, jobs):
+        if pool is None:
+            return [func(job) for job in jobs]
+        return pool.imap(func, jobs, chunksize=_BATCH_CHUNK)
+
+    try:
+        logger.debug('Counting classes of {n} maps one window at a '
+                     'time'.format(n=len(maps)))
+        partials = list(run(_batch_histograms,
+                            ((maps, window) for window in windows)))
+
+        designs = []
+        for m, map_seed in enumerate(_seed_sequence(seed).spawn(len(maps))):
+            _, sample_seed, order_seed = map_seed.spawn(3)
+            histogram = merge_histograms(p[m] for p in partials)
+            if size == 'variance':
+                map_size = _variance_size(histogram, mask, allocation,
+                                          users_accuracy, target_se)
+            else:
+                map_size = size
+
+            classes, class_px = histogram
+            unmasked = ~in_classes(classes, mask)
+            classes, class_px = classes[unmasked], class_px[unmasked]
+            logger.debug('Found {n} classes in map {m}'.format(
+                n=classes.size, m=m + 1))
+
+            counts = _sample_counts(method, classes, class_px, map_size,
+                                    allocation,
+                                    users_accuracy=users_accuracy,
+                                    minimum=minimum)
+            if method == 'stratified':
+                ranks = _stratified_ranks(classes, counts, class_px,
+                                          seed=sample_seed)
+            elif method == 'random':
+                ranks = _simple_ranks(classes, counts, class_px,
+                                      seed=sample_seed)
+            else:
+                ranks = None
+            designs.append({'classes': classes, 'counts': counts,
+                            'class_px': class_px, 'ranks': ranks,
+                            'sample_seed': sample_seed,
+                            'order_seed': order_seed})
+
+        if method == 'systematic':
+            logger.debug('Reading systematic grid of each map')
+            samples = list(run(_batch_systematic, (
+                (f, b, d['classes'], d['counts'], d['class_px'],
+                 allocation is not None, d['sample_seed'])
+                for (f, b), d in zip(maps, designs))))
+        else:
+            selected = [_window_ranks(d['classes'], d['ranks'],
+                                      [p[m] for p in partials])
+                        for m, d in enumerate(designs)]
+            jobs = [(maps, windows[w],
+                     [(d['classes'], s[w]) if w in s else None
+                      for d, s in zip(designs, selected)])
+                    for w in range(len(windows))
+                    if any(w in s for s in selected)]
+            logger.debug('Locating samples within {n} of {t} '
+                         'windows'.format(n=len(jobs), t=len(windows)))
+
+            parts = [[] for _ in maps]
+            for found in run(_batch_select, jobs):
+                for m, records in enumerate(found):
+                    if records is not None:
+                        parts[m].append(records)
+            samples = [np.concatenate(p) if p else
+                       _empty_records(0, d['classes'])
+                       for p, d in zip(parts, designs)]
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        else:
+            # Close maps read in this process so later calls reopen them
+            _close_batch_datasets()
+
+    output = []
+    for records, design in zip(samples, designs):
+        if method == 'random':
+            records['stratum'] = 1
+        output.append(_order_records(records, order, design['order_seed']))
+
+    return output
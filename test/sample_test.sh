@@ -13,3 +13,76 @@
     --raster test.gtif --vector test.shp \
     --seed 10000 \
     simple LC_20050101_coded
+
+../script/sample_map.py -v \
+    --size 110 --allocation "10, 10, 10, 50, 10, 10, 10" \
+    --mask 0 --ndv 255 \
+    --raster test.gtif --vector test.shp \
+    --seed 10000 --engine block \
+    stratified LC_20050101_coded
+
+../script/sample_map.py -v \
+    --size 110 \
+    --mask 0 --ndv 255 \
+    --raster test.gtif --vector test.shp \
+    --seed 10000 --engine reservoir \
+    simple LC_20050101_coded
+
+../script/sample_map.py -v \
+    --size 110 --allocation "10, 10, 10, 50, 10, 10, 10" \
+    --mask 0 --ndv 255 \
+    --raster test.gtif --vector test.gpkg --vformat GPKG \
+    --geometry both \
+    --seed 10000 \
+    stratified LC_20050101_coded
+
+../script/sample_map.py -v \
+    --size 110 \
+    --mask 0 --ndv 255 \
+    --raster test.gtif --vector test.shp \
+    --seed 10000 \
+    systematic LC_20050101_coded
+
+../script/sample_map.py -v \
+    --size 110 --allocation "10, 10, 10, 50, 10, 10, 10" \
+    --mask 0 --ndv 255 \
+    --raster test.gtif --vector test.shp \
+    --seed 10000 \
+    systematic LC_20050101_coded
+
+../script/sample_map.py -v \
+    --size 300 --allocation good_practices --minimum 30 \
+    --mask 0 --ndv 255 \
+    --raster test.gtif --vector test.shp \
+    --seed 10000 \
+    stratified LC_20050101_coded
+
+../script/sample_map.py -v \
+    --size variance --se 0.01 --users 0.85 --allocation neyman \
+    --mask 0 --ndv 255 \
+    --raster test.gtif --vector test.shp \
+    --seed 10000 \
+    stratified LC_20050101_coded
+
+gdal_translate -q -of VRT LC_20050101_coded LC_20050101_copy.vrt
+../script/sample_map.py -v \
+    --size 300 --allocation proportional \
+    --mask 0 --ndv 255 --processes 2 \
+    --raster test.gtif --vector test.shp \
+    --seed 10000 \
+    stratified LC_20050101_coded LC_20050101_copy.vrt
+
+# Crosstabulate the map with the sample's strata as reference labels
+../script/crosstab.py -v -a STRATUM \
+    LC_20050101_coded test.shp crosstab.csv
+
+../script/crosstab.py -v -a STRATUM --threads 2 \
+    LC_20050101_coded test.shp crosstab.csv
+
+../script/crosstab.py -v -a STRATUM --points \
+    --stats stats.csv \
+    LC_20050101_coded test.shp crosstab.csv
+
+../script/crosstab.py -v -a STRATUM --points \
+    --stats stats.csv --bootstrap 200 --processes 2 --seed 10000 \
+    LC_20050101_coded test.shp crosstab.csv